@@ -0,0 +1,91 @@
+"""
+嫌いな生徒・前回チームの制約をペア毎に作る方式と、クリーク毎にまとめる方式の比較
+
+    python benchmarks/bench_constraints.py
+
+build はどちらも制約の行を作る時間だけを測る (StudentTable は事前に作る)
+solve は matching() 全体の時間で、pair は同じモデルの clique_cover を「全ての辺を1行ずつ」に置き換えたもの
+"""
+from unittest import mock
+
+import numpy as np
+from pulp import LpProblem, LpMaximize, LpVariable, LpBinary, lpSum
+
+from common import all_requests, timeit, suppress_stdout
+from models.table import StudentTable
+from services.cliques import previous_adjacency, clique_cover, previous_groups
+from services.match import matching
+
+
+def pairwise_rows(prob, x, students, num_teams, unique_previous):
+    # 以前の実装: 前回チーム T×T 行 + 嫌いなペア毎に T 行
+    for t in range(num_teams):
+        for prev_team in range(num_teams):
+            prob += lpSum(x[(i, t)] for i in range(len(students)) if students[i].previous == prev_team) <= unique_previous
+    for i in range(len(students)):
+        for disliked in students[i].dislikes:
+            if disliked < len(students):
+                for t in range(num_teams):
+                    prob += x[(i, t)] + x[(disliked, t)] <= 1
+
+
+def clique_rows(prob, x, table, num_teams, unique_previous):
+    # services.match.matching と同じ組み立て方
+    previous, adjacency = table.previous, table.dislike_adjacency()
+    if unique_previous == 1:
+        adjacency |= previous_adjacency(previous)
+    else:
+        for members in previous_groups(previous, unique_previous):
+            for t in range(num_teams):
+                prob += lpSum(x[(i, t)] for i in members) <= unique_previous
+    for clique in clique_cover(adjacency):
+        for t in range(num_teams):
+            prob += lpSum(x[(i, t)] for i in clique) <= 1
+
+
+def edge_cover(adjacency):
+    # クリークにまとめず、全ての辺をそれぞれ1つの制約にする (ペア毎の方式)
+    rows, cols = np.nonzero(np.triu(adjacency, k=1))
+    return [np.array([i, j], dtype=np.int64) for i, j in zip(rows, cols)]
+
+
+def pairwise_matching(table, constraint):
+    with mock.patch("services.match.clique_cover", edge_cover):
+        return matching(table, constraint)
+
+
+def build(rows, students, constraint):
+    prob = LpProblem("bench", LpMaximize)
+    x = {
+        (i, t): LpVariable(f"x_{i}_{t}", cat=LpBinary)
+        for i in range(len(students))
+        for t in range(constraint.max_num_teams)
+    }
+    rows(prob, x, students, constraint.max_num_teams, constraint.unique_previous)
+    return prob
+
+
+def main():
+    print(
+        f"{'instance':<28}{'rows(pair)':>12}{'rows(clique)':>14}{'build(pair)':>13}{'build(clique)':>15}"
+        f"{'solve(pair)':>13}{'solve(clique)':>15}"
+    )
+    for name, req in all_requests():
+        students, constraint = req.student_constraints, req.constraint
+        table = StudentTable.from_constraints(students)
+        pair_rows = len(build(pairwise_rows, students, constraint).constraints)
+        clique_rows_ = len(build(clique_rows, table, constraint).constraints)
+        pair_time = timeit(lambda: build(pairwise_rows, students, constraint))
+        clique_time = timeit(lambda: build(clique_rows, table, constraint))
+        with suppress_stdout():
+            pair_solve = timeit(lambda: pairwise_matching(table, constraint), repeat=3)
+            clique_solve = timeit(lambda: matching(table, constraint), repeat=3)
+        print(
+            f"{name:<28}{pair_rows:>12}{clique_rows_:>14}"
+            f"{pair_time * 1e3:>11.2f}ms{clique_time * 1e3:>13.2f}ms"
+            f"{pair_solve * 1e3:>11.1f}ms{clique_solve * 1e3:>13.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+GraphQL の呼び出しのスループット
+リクエスト毎にセッションを開く場合 (以前の client.execute_async) と
+ワーカー毎に1つのセッションを使い回す場合 (routers.graphql.execute) を比較する
+Hasura の代わりにローカルのモックサーバー (HTTP) を使うため、TLS のハンドシェイクの分は含まない
+
+    python benchmarks/bench_graphql.py [リクエスト数] [同時実行数]
+"""
+import os
+import sys
+import time
+import asyncio
+
+from aiohttp import web
+from gql import Client
+from gql.transport.aiohttp import AIOHTTPTransport
+
+import common  # noqa: F401
+
+HOST, PORT = "127.0.0.1", 8765
+os.environ["GRAPHQL_API_ENDPOINT"] = f"http://{HOST}:{PORT}/v1/graphql"
+os.environ.setdefault("HASURA_GRAPHQL_ADMIN_SECRET", "secret")
+
+from routers import graphql  # noqa: E402
+from routers.documents import GET_DB_VERSION  # noqa: E402
+
+RESPONSE = {
+    "data": {
+        "goose_db_version": [
+            {"id": i, "is_applied": True, "tstamp": "2024-06-29T04:22:26.976814", "version_id": i}
+            for i in range(5)
+        ]
+    }
+}
+
+
+async def start_server(connections: set):
+    async def handler(request: web.Request):
+        # 同じ接続で来たリクエストは同じ (host, port) になる
+        connections.add(request.transport.get_extra_info("peername"))
+        return web.json_response(RESPONSE)
+
+    app = web.Application()
+    app.router.add_post("/v1/graphql", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+
+async def per_call():
+    # 1つの Client を同時に execute_async すると TransportAlreadyConnected になるため、呼び出し毎に作る
+    client = Client(
+        transport=AIOHTTPTransport(
+            url=os.environ["GRAPHQL_API_ENDPOINT"],
+            headers={"x-hasura-admin-secret": os.environ["HASURA_GRAPHQL_ADMIN_SECRET"]},
+        ),
+        schema=graphql.get_client().schema,
+    )
+    return await client.execute_async(GET_DB_VERSION.node)
+
+
+async def pooled():
+    return await graphql.execute(GET_DB_VERSION)
+
+
+async def measure(fn, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fn()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return requests / (time.perf_counter() - start)
+
+
+async def run(requests: int, concurrency: int):
+    connections = set()
+    runner = await start_server(connections)
+    await graphql.get_session()
+    print(f"{'mode':<12}{'requests':>10}{'concurrency':>13}{'req/s':>10}{'connections':>13}")
+    for mode, fn in [("per call", per_call), ("pooled", pooled)]:
+        await fn()
+        connections.clear()
+        rps = await measure(fn, requests, concurrency)
+        print(f"{mode:<12}{requests:>10}{concurrency:>13}{rps:>10.0f}{len(connections):>13}")
+    await graphql.close_client()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    ))
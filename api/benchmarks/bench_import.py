@@ -0,0 +1,78 @@
+"""
+API の起動時間 (import main) のベンチマーク
+python -X importtime の結果から累積時間の大きいモジュールを表示し、予算を超えた場合は終了コード 1 を返す
+予算は同じマシンで測った import fastapi の時間に対する比 (マシンの速さに依らないようにする)
+重いモジュール (LAZY_MODULES) が import main の時点で読み込まれていないことも確かめる
+
+    python benchmarks/bench_import.py [上位の件数]
+    IMPORT_BUDGET_RATIO=1.5 python benchmarks/bench_import.py
+"""
+import os
+import sys
+import subprocess
+
+from common import API_DIR
+
+# import main にかけてよい時間の、import fastapi に対する比 (それぞれ繰り返した中の最短)
+IMPORT_BUDGET_RATIO = float(os.getenv("IMPORT_BUDGET_RATIO", "1.75"))
+REPEAT = int(os.getenv("IMPORT_REPEAT", "5"))
+
+# 初回利用時か lifespan で読み込むモジュール
+LAZY_MODULES = [
+    "gql", "aiohttp", "pulp", "passlib", "openai", "pandas", "matplotlib", "numpy",
+    "services.match", "services.sweep", "services.pool", "services.surveys",
+]
+
+SCRIPT = f"""
+import sys
+import main
+print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+"""
+
+
+def import_times(script: str = SCRIPT) -> tuple[dict[str, tuple[int, int]], list[str]]:
+    """
+    新しいインタプリタで script (既定は import main) を実行し、モジュール毎の (自身, 累積) の時間 (マイクロ秒) と
+    読み込まれてしまった LAZY_MODULES を返す
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=API_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return times, loaded
+
+
+def main(top: int):
+    runs = [import_times() for _ in range(REPEAT)]
+    times, loaded = min(runs, key=lambda r: r[0]["main"][1])
+    total_ms = times["main"][1] / 1000
+    baseline_ms = min(import_times("import fastapi")[0]["fastapi"][1] for _ in range(REPEAT)) / 1000
+    budget_ms = baseline_ms * IMPORT_BUDGET_RATIO
+
+    print(f"{'module':<40}{'self':>10}{'cumulative':>14}")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda t: -t[1][1])[:top]:
+        print(f"{name:<40}{self_us / 1000:>8.1f}ms{cumulative_us / 1000:>12.1f}ms")
+
+    print(
+        f"\nimport main: {total_ms:.1f}ms, import fastapi: {baseline_ms:.1f}ms "
+        f"(x{total_ms / baseline_ms:.2f}, best of {REPEAT}, budget x{IMPORT_BUDGET_RATIO:.2f} = {budget_ms:.0f}ms)"
+    )
+    if loaded:
+        print(f"eagerly imported: {', '.join(loaded)}")
+    if total_ms > budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,80 @@
+"""
+ログインが集中している間の他のエンドポイント (ヘルスチェック) の応答時間
+bcrypt をイベントループ上で計算する場合 (以前の実装) と専用のスレッドプールで計算する場合を比較する
+GraphQL はハッシュ済みのパスワードを返すだけのスタブに置き換える
+
+    OPENAI_API_KEY=x python benchmarks/bench_login.py [ログイン数]
+"""
+import sys
+import time
+import asyncio
+
+import httpx
+import numpy as np
+
+import common  # noqa: F401
+import main
+from routers import users
+from services import passwords
+
+PASSWORD = "password"
+HASHED = passwords.pwd_context().hash(PASSWORD)
+PING_INTERVAL = 0.01
+
+
+async def fake_execute(query, variable_values=None):
+    await asyncio.sleep(0.005)
+    return {"teachers": [{"id": 1, "email": "teacher@example.com", "password": HASHED}]}
+
+
+async def inline_verify_password(password, hashed):
+    return passwords._verify(password, hashed)
+
+
+async def storm(client: httpx.AsyncClient, logins: int) -> tuple[np.ndarray, float]:
+    """
+    logins 件のログインを同時に送り、その間 PING_INTERVAL 毎にヘルスチェックを送る
+    (ヘルスチェックの応答時間 [ms], 全てのログインが終わるまでの時間 [s]) を返す
+    応答時間は送る予定だった時刻から測る (イベントループが止まって送れなかった時間も含める)
+    """
+    latencies = []
+    done = asyncio.Event()
+
+    async def ping():
+        due = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            await client.get("/")
+            latencies.append((time.perf_counter() - due) * 1000)
+            due += PING_INTERVAL
+
+    async def login():
+        r = await client.post("/users/signin", json={"email": "teacher@example.com", "password": PASSWORD})
+        assert r.status_code == 200, r.text
+
+    start = time.perf_counter()
+    pinger = asyncio.create_task(ping())
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await pinger
+    return np.array(latencies), elapsed
+
+
+async def run(logins: int):
+    users.execute = fake_execute
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        print(f"{'mode':<16}{'logins':>8}{'elapsed':>10}{'pings':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+        for mode, verify in [("event loop", inline_verify_password), ("bcrypt pool", passwords.verify_password)]:
+            users.verify_password = verify
+            latencies, elapsed = await storm(client, logins)
+            print(
+                f"{mode:<16}{logins:>8}{elapsed:>9.2f}s{len(latencies):>8}"
+                f"{np.percentile(latencies, 50):>8.1f}ms{np.percentile(latencies, 99):>8.1f}ms{latencies.max():>8.1f}ms"
+            )
+    passwords.shutdown_executor()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 40))
@@ -0,0 +1,51 @@
+"""
+calc_team_report のマイクロベンチマーク
+以前の (コメントアウトされていた) 二重ループの集計と比較する
+
+    python benchmarks/bench_report.py
+"""
+import numpy as np
+
+from common import all_requests, synthetic_request, timeit
+from models.table import StudentTable, MI_CATEGORIES
+from services.match import calc_team_report
+
+
+def loop_report(students, teams):
+    # calc_mi_score / calc_sex_by_team / calc_previous_by_team / calc_dislikes_by_team 相当
+    team_scores = {team: [0] * len(MI_CATEGORIES) for team in teams}
+    team_sexes = {team: [] for team in teams}
+    team_previous = {team: [] for team in teams}
+    team_dislikes = {team: [] for team in teams}
+    for team, members in teams.items():
+        for member in members:
+            for i, cat in enumerate(MI_CATEGORIES):
+                team_scores[team][i] += getattr(students[member], cat)
+            team_sexes[team].append(students[member].sex)
+            team_previous[team].append(students[member].previous)
+            team_dislikes[team] += [students[member].dislikes]
+    return team_scores, team_sexes, team_previous, team_dislikes
+
+
+def random_teams(num_students, num_teams, seed=0):
+    rng = np.random.default_rng(seed)
+    assignment = rng.permutation(num_students) % num_teams
+    return {t: np.flatnonzero(assignment == t).tolist() for t in range(num_teams)}
+
+
+def main():
+    cases = [(name, req) for name, req in all_requests()]
+    cases.append(("synthetic-1000", synthetic_request(1000, 250)))
+    print(f"{'instance':<28}{'loops':>12}{'report':>12}{'table+report':>15}")
+    for name, req in cases:
+        students = req.student_constraints
+        teams = random_teams(len(students), req.constraint.max_num_teams)
+        table = StudentTable.from_constraints(students)
+        loop_time = timeit(lambda: loop_report(students, teams), repeat=20)
+        report_time = timeit(lambda: calc_team_report(table, teams), repeat=20)
+        total_time = timeit(lambda: calc_team_report(StudentTable.from_constraints(students), teams), repeat=20)
+        print(f"{name:<28}{loop_time * 1e6:>10.0f}us{report_time * 1e6:>10.0f}us{total_time * 1e6:>13.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+API_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(API_DIR))
+
+from models.match import MatchingRequest, StudentConstraint  # noqa: E402
+
+# 現行フォーマット (student_constraints) のサンプルリクエスト
+SAMPLE_REQUESTS = [
+    API_DIR / "requests" / "test.http",
+    API_DIR / "bkp" / "requests" / "2024-07.http",
+]
+
+
+def load_http_request(path: Path) -> MatchingRequest:
+    """
+    .http ファイルから JSON ボディを取り出して MatchingRequest にする
+    """
+    text = path.read_text()
+    body = text[text.index("{"):text.rindex("}") + 1]
+    return MatchingRequest(**json.loads(body))
+
+
+def synthetic_request(num_students: int, max_num_teams: int, seed: int = 0) -> MatchingRequest:
+    """
+    サンプルを大きくした合成データ（学年単位のクラス数を想定）
+    """
+    rng = np.random.default_rng(seed)
+    members_per_team = -(-num_students // max_num_teams)
+    students = []
+    for i in range(num_students):
+        mi = rng.integers(1, 10, size=8)
+        num_dislikes = rng.choice([0, 0, 0, 1, 2, 3])
+        students.append(
+            StudentConstraint(
+                student_no=i,
+                dislikes=[int(d) for d in rng.choice(num_students, size=num_dislikes, replace=False) if d != i],
+                previous=int(i % max_num_teams),
+                **{f"mi_{c}": int(v) for c, v in zip("abcdefgh", mi)},
+                leader=int(rng.choice([1, 3, 8])),
+                eyesight=int(rng.choice([1] * 19 + [3])),
+                sex=int(i % 2),
+            )
+        )
+    return MatchingRequest(
+        student_constraints=students,
+        constraint={
+            "max_num_teams": max_num_teams,
+            "members_per_team": members_per_team,
+            "unique_previous": 1,
+        },
+    )
+
+
+def all_requests() -> list[tuple[str, MatchingRequest]]:
+    requests = [(p.relative_to(API_DIR).as_posix(), load_http_request(p)) for p in SAMPLE_REQUESTS]
+    requests.append(("synthetic-60", synthetic_request(60, 15)))
+    return requests
+
+
+def timeit(fn, repeat: int = 5) -> float:
+    """
+    repeat 回実行した中で最も速かった時間 (秒) を返す
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@contextmanager
+def suppress_stdout():
+    """
+    CBC のログ（子プロセスの標準出力）でベンチマークの出力が埋もれないようにする
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(devnull)
+        os.close(saved)
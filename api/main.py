@@ -1,16 +1,23 @@
 import os
 import sys
+import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 
 from routers import (
     users_router,
     match_router,
     # solve_router,
     system_router,
-    llm_router
+    llm_router,
+    hooks_router,
 )
+from services import passwords, warmup, metrics
+from services.timings import RequestTimingMiddleware
+from routers.graphql import check_documents, get_session, close_client
 from logging import getLogger, StreamHandler, INFO
 
 
@@ -22,6 +29,22 @@ handler.setLevel(INFO)
 logger.addHandler(handler)
 logger.setLevel(INFO)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_documents()
+    await get_session()
+    # ソルバーのウォームアップは / に応答しながら進め、終わったら /ready を返す
+    warmup_task = asyncio.create_task(warmup.warm_up())
+    yield
+    warmup_task.cancel()
+    from services.pool import shutdown_executor
+
+    shutdown_executor()
+    passwords.shutdown_executor()
+    await close_client()
+
+
 app = FastAPI(
     title="Synergy Matchmaker",
     description="Synergy Matchmaker API",
@@ -29,6 +52,7 @@ app = FastAPI(
     docs_url=None if is_prod else "/docs",
     redoc_url=None if is_prod else "/redoc",
     openapi_url=None if is_prod else "/openapi.json",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -41,6 +65,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimingMiddleware)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 # @app.middleware("http")
 # async def log_middle(request: Request, call_next):
@@ -65,11 +91,27 @@ app.add_middleware(
 
 @app.get("/", include_in_schema=False)
 async def health_check():
+    # liveness (ウォームアップ中も応答する)
     return {"message": "Health check succeeded."}
 
 
+@app.get("/ready", include_in_schema=False)
+async def readiness_check():
+    # readiness (ソルバーのウォームアップが終わるまでは 503)
+    if not warmup.readiness.ready:
+        return JSONResponse(status_code=503, content=warmup.readiness.status())
+    return warmup.readiness.status()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    # Prometheus のテキスト形式 (このワーカーの値)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 app.include_router(users_router)
 # app.include_router(solve_router)
 app.include_router(match_router)
 app.include_router(system_router)
 app.include_router(llm_router)
+app.include_router(hooks_router)
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import Optional
+from typing import List
+
+
+class ValueMapping(BaseModel):
+    source: str
+    target: int
+
+
+class FieldMapping(BaseModel):
+    # Student / StudentPreference のフィールド名
+    field: str
+    # CSV の列番号 (0-index)、列が無い場合は None
+    column: Optional[int]
+    # 文字列の回答を数値に変換する対応表 (性別・リーダー・視力など)
+    values: List[ValueMapping] = []
+    # 空欄や対応表に無い値の場合の値
+    default: Optional[int] = None
+
+
+class MappingSpec(BaseModel):
+    # "class" (名簿) または "survey" (アンケート)
+    kind: str
+    fields: List[FieldMapping]
@@ -1,7 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional
 from typing import List
 
+# /match/rotation で1回のリクエストに計画できる回数の上限
+MAX_ROTATION_ROUNDS = 20
+
 
 class Student(BaseModel):
     student_no: int
@@ -64,6 +67,68 @@ class Constraint(BaseModel):
     group_diff_coeff: float | None = 1.5
 
 
+class SolverOptions(BaseModel):
+    # CBC の乱数の種 (randomSeed / randomCbcSeed)、None の場合は CBC の既定値
+    seed: int | None = Field(None, ge=0)
+    # CBC のスレッド数、None の場合は CBC の既定値 (1)
+    threads: int | None = Field(None, ge=1)
+    # True の場合、同じ入力と seed には同じ結果を返す
+    # 探索は時間ではなくノード数で打ち切り、並列探索は再現可能なモードにし、sweep は全ての候補を解く
+    deterministic: bool = False
+
+
 class MatchingRequest(BaseModel):
+    # student_constraints の代わりに survey_id を指定すると、アンケートの回答を API が取得する
+    student_constraints: List[StudentConstraint] = []
+    survey_id: int | None = None
+    constraint: Constraint
+    # survey_id を指定した場合、結果を matching_results / teams に保存する (レスポンスを返した後)
+    save: bool = False
+    # True の場合、処理の段階毎の時間 (ミリ秒) をレスポンスの timings に含める
+    timings: bool = False
+    solver: SolverOptions = SolverOptions()
+
+    @model_validator(mode="after")
+    def check_source(self):
+        # 生徒の制約はリクエストに含めるか、アンケートから取得するかのどちらか一方
+        if bool(self.student_constraints) == (self.survey_id is not None):
+            raise ValueError("Specify exactly one of student_constraints or survey_id")
+        return self
+
+
+class RotationRequest(BaseModel):
+    student_constraints: List[StudentConstraint]
+    constraint: Constraint
+    # 1回のリクエストで計画する回数 (各回で1回ずつ解くため上限を設ける)
+    rounds: int = Field(3, ge=1, le=MAX_ROTATION_ROUNDS)
+    # 前回のチームを含め、同じ生徒の組が同じチームになってよい回数
+    max_pair_meetings: int = Field(1, ge=1)
+    solver: SolverOptions = SolverOptions()
+
+
+class SweepRequest(BaseModel):
     student_constraints: List[StudentConstraint]
+    # max_num_teams と members_per_team は候補毎に上書きする
     constraint: Constraint
+    min_num_teams: int = Field(ge=1)
+    max_num_teams: int = Field(ge=1)
+    min_members_per_team: int | None = Field(None, ge=1)
+    max_members_per_team: int | None = Field(None, ge=1)
+    solver: SolverOptions = SolverOptions()
+
+    @model_validator(mode="after")
+    def check_ranges(self):
+        num_students = len(self.student_constraints)
+        if self.min_num_teams > self.max_num_teams:
+            raise ValueError("min_num_teams must not be greater than max_num_teams")
+        if self.max_num_teams > num_students:
+            raise ValueError("max_num_teams must not be greater than the number of students")
+        if (
+            self.min_members_per_team is not None
+            and self.max_members_per_team is not None
+            and self.min_members_per_team > self.max_members_per_team
+        ):
+            raise ValueError("min_members_per_team must not be greater than max_members_per_team")
+        if self.min_members_per_team is not None and self.min_members_per_team > num_students:
+            raise ValueError("min_members_per_team must not be greater than the number of students")
+        return self
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from models.match import MatchingRequest, StudentConstraint
+
+MI_CATEGORIES = ["mi_a", "mi_b", "mi_c", "mi_d", "mi_e", "mi_f", "mi_g", "mi_h"]
+
+
+@dataclass(frozen=True)
+class StudentTable:
+    """
+    StudentConstraint のリストを列指向の NumPy 配列にまとめたもの
+    リクエスト毎に1回だけ作り、モデル構築・結果の取り出し・レポートで共有する
+    行の並びは student_constraints の並び (0-index) と同じ
+    """
+    student_no: np.ndarray  # int64 (n,)
+    mi: np.ndarray  # int8 (n, 8)
+    sex: np.ndarray  # int8 (n,) 0: male, 1: female
+    leader: np.ndarray  # int8 (n,) {1, 3, 8}
+    eyesight: np.ndarray  # int8 (n,) {1, 3, 8}
+    previous: np.ndarray  # int64 (n,) 前回のチームが無い場合は -1
+    dislike_indptr: np.ndarray  # int64 (n + 1,) 嫌いな生徒の CSR
+    dislike_indices: np.ndarray  # int64 (nnz,)
+
+    def __len__(self) -> int:
+        return len(self.sex)
+
+    @classmethod
+    def from_constraints(cls, student_constraints: list[StudentConstraint]) -> "StudentTable":
+        n = len(student_constraints)
+        student_no = np.array(
+            [i if s.student_no is None else s.student_no for i, s in enumerate(student_constraints)],
+            dtype=np.int64,
+        )
+        mi = np.array(
+            [[getattr(s, cat) for cat in MI_CATEGORIES] for s in student_constraints],
+            dtype=np.int8,
+        ).reshape(n, len(MI_CATEGORIES))
+        previous = np.array(
+            [-1 if s.previous is None else s.previous for s in student_constraints],
+            dtype=np.int64,
+        )
+
+        # 範囲外の名簿番号と自分自身への指定は無視する
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indices = []
+        for i, s in enumerate(student_constraints):
+            targets = [d for d in s.dislikes if 0 <= d < n and d != i]
+            indices += targets
+            indptr[i + 1] = indptr[i] + len(targets)
+
+        return cls(
+            student_no=student_no,
+            mi=mi,
+            sex=np.array([s.sex for s in student_constraints], dtype=np.int8),
+            leader=np.array([s.leader for s in student_constraints], dtype=np.int8),
+            eyesight=np.array([s.eyesight for s in student_constraints], dtype=np.int8),
+            previous=previous,
+            dislike_indptr=indptr,
+            dislike_indices=np.array(indices, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_request(cls, req: MatchingRequest) -> "StudentTable":
+        return cls.from_constraints(req.student_constraints)
+
+    def dislikes_of(self, i: int) -> np.ndarray:
+        return self.dislike_indices[self.dislike_indptr[i]:self.dislike_indptr[i + 1]]
+
+    def dislike_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (嫌っている生徒, 嫌われている生徒) の配列の組
+        """
+        rows = np.repeat(np.arange(len(self)), np.diff(self.dislike_indptr))
+        return rows, self.dislike_indices
+
+    def dislike_adjacency(self) -> np.ndarray:
+        """
+        嫌いな関係を無向グラフとみなした隣接行列 (bool, n×n)
+        """
+        adjacency = np.zeros((len(self), len(self)), dtype=bool)
+        rows, cols = self.dislike_pairs()
+        adjacency[rows, cols] = True
+        return adjacency | adjacency.T
@@ -3,3 +3,4 @@ from .users import router as users_router
 from .systems import router as system_router
 from .match import router as match_router
 from .llm import router as llm_router
+from .hooks import router as hooks_router
@@ -0,0 +1,269 @@
+import hashlib
+from dataclasses import dataclass
+
+from graphql import DocumentNode, GraphQLSchema, OperationDefinitionNode, parse, print_ast, validate
+
+
+@dataclass(frozen=True)
+class Document:
+    """
+    起動時に1回だけ解析・検証する GraphQL の文書
+    """
+    name: str  # 操作名 (Hasura の allow-list のクエリ名)
+    node: DocumentNode
+    query: str  # Hasura に送る文字列 (print_ast の結果)
+    sha256: str  # query のハッシュ (Persisted Query の ID)
+
+
+DOCUMENTS: dict[str, Document] = {}
+
+
+def register(source: str) -> Document:
+    """
+    名前付きの操作を1つだけ含む文書を解析して登録する
+    """
+    node = parse(source)
+    operations = [d for d in node.definitions if isinstance(d, OperationDefinitionNode)]
+    if len(operations) != 1 or operations[0].name is None:
+        raise ValueError("A document must contain exactly one named operation")
+    name = operations[0].name.value
+    if name in DOCUMENTS:
+        raise ValueError(f"Duplicate GraphQL document: {name}")
+    query = print_ast(node)
+    document = Document(
+        name=name,
+        node=node,
+        query=query,
+        sha256=hashlib.sha256(query.encode()).hexdigest(),
+    )
+    DOCUMENTS[name] = document
+    return document
+
+
+def validate_documents(schema: GraphQLSchema):
+    """
+    登録した全ての文書をスキーマで検証する (起動時に1回だけ)
+    """
+    errors = [
+        f"{document.name}: {error.message}"
+        for document in DOCUMENTS.values()
+        for error in validate(schema, document.node)
+    ]
+    if errors:
+        raise ValueError("Invalid GraphQL documents:\n" + "\n".join(errors))
+
+
+def allow_list(collection: str = "allowed-queries") -> dict:
+    """
+    Hasura の allow-list に登録するクエリコレクション (メタデータ API の create_query_collection の args)
+        python -c "import json, routers; from routers.documents import allow_list; print(json.dumps(allow_list()))"
+    """
+    return {
+        "name": collection,
+        "definition": {
+            "queries": [
+                {"name": document.name, "query": document.query}
+                for document in DOCUMENTS.values()
+            ]
+        },
+    }
+
+
+def persisted_queries() -> dict[str, str]:
+    """
+    sha256 ハッシュ → クエリの対応表
+    """
+    return {document.sha256: document.query for document in DOCUMENTS.values()}
+
+
+# users
+
+GET_USER = register(
+    """
+    query getUser($email: String!) {
+        teachers(limit:1, where: {email: {_eq: $email}}) {
+          id
+          name
+          family_name
+          given_name
+          school_id
+          email
+          password
+          status
+          created_at
+          updated_at
+          expired_at
+        }
+    }
+    """
+)
+
+GET_PASSWORD = register(
+    """
+    query getPassword($user_id: bigint!) {
+        teachers_by_pk(id: $user_id) {
+          id
+          password
+        }
+    }
+    """
+)
+
+UPDATE_TEACHER_PASSWORD = register(
+    """
+    mutation updateTeacherPassword(
+      $user_id: bigint!,
+      $encrypted_password: String,
+      $updated_at: timestamp,
+    ) {
+        update_teachers_by_pk(
+          pk_columns: {id: $user_id}, 
+          _set: {
+            password: $encrypted_password,
+            updated_at: $updated_at
+          }
+        ) {
+          id
+          password
+          updated_at
+        }
+    }
+    """
+)
+
+UPDATE_TEACHER = register(
+    """
+    mutation updateTeacher(
+      $user_id: bigint!,
+      $name: String,
+      $family_name: String,
+      $given_name: String,
+      $school_id: bigint,
+      $status: Int,
+      $updated_at: timestamp,
+    ) {
+        update_teachers_by_pk(
+          pk_columns: {id: $user_id}, 
+          _set: {
+            name: $name,
+            family_name: $family_name,
+            given_name: $given_name,
+            school_id: $school_id,
+            status: $status,
+            updated_at: $updated_at
+          }
+        ) {
+          id
+          name
+          family_name
+          given_name
+          school_id
+          email
+          status
+          created_at
+          updated_at
+          expired_at
+        }
+    }
+    """
+)
+
+DELETE_USER = register(
+    """
+    mutation deleteUser(
+      $user_id: bigint!,
+    ) {
+        delete_teachers_by_pk(
+          id: $user_id
+        ) {
+            id
+        }
+    }
+    """
+)
+
+# match
+
+# アンケートの回答・生徒・嫌いな生徒をまとめて取得する (複数のアンケートを1回で取得できる)
+GET_SURVEY_PREFERENCES = register(
+    """
+    query getSurveyPreferences($survey_ids: [bigint!]!) {
+        surveys(where: {id: {_in: $survey_ids}}) {
+          id
+          updated_at
+          class {
+            name
+          }
+          student_preferences(order_by: {id: asc}) {
+            id
+            previous_team
+            mi_a
+            mi_b
+            mi_c
+            mi_d
+            mi_e
+            mi_f
+            mi_g
+            mi_h
+            leader
+            eyesight
+            updated_at
+            student {
+              id
+              student_no
+              sex
+            }
+            student_dislikes {
+              student_id
+            }
+          }
+        }
+    }
+    """
+)
+
+# キャッシュしたアンケートが最新か確かめる (アンケートと回答の更新日時と回答数だけを取得する)
+GET_SURVEY_VERSIONS = register(
+    """
+    query getSurveyVersions($survey_ids: [bigint!]!) {
+        surveys(where: {id: {_in: $survey_ids}}) {
+          id
+          updated_at
+          student_preferences_aggregate {
+            aggregate {
+              count
+              max {
+                updated_at
+              }
+            }
+          }
+        }
+    }
+    """
+)
+
+# マッチング結果と全てのチームを1回の (入れ子の) insert で保存する
+INSERT_MATCHING_RESULT = register(
+    """
+    mutation insertMatchingResult($object: matching_results_insert_input!) {
+        insert_matching_results_one(object: $object) {
+          id
+        }
+    }
+    """
+)
+
+# systems
+
+GET_DB_VERSION = register(
+    """
+    query getDbVersion {
+        goose_db_version {
+            id
+            is_applied
+            tstamp
+            version_id
+        }
+    }
+    """
+)
@@ -1,20 +1,122 @@
 import os
-from gql import Client, gql
-from gql.transport.aiohttp import AIOHTTPTransport
-
-# Select your transport with a defined url endpoint
-transport = AIOHTTPTransport(
-    url=os.environ.get("GRAPHQL_API_ENDPOINT"),
-    headers={
-        "x-hasura-admin-secret": os.environ.get("HASURA_GRAPHQL_ADMIN_SECRET"),
-        'content-type': 'application/json',
-    }
-)
+import asyncio
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .documents import Document, validate_documents
+
+logger = logging.getLogger("uvicorn.app")
 
-# Create a GraphQL client using the defined transport
-client = Client(
-    transport=transport,
-    fetch_schema_from_transport=True,
+# Hasura のスキーマのスナップショット (起動時や接続毎にイントロスペクションしない)
+GRAPHQL_SCHEMA_PATH = Path(
+    os.getenv("GRAPHQL_SCHEMA_PATH", Path(__file__).resolve().parent.parent / "schema.graphql")
 )
 
-gql = gql
+# Hasura への同時接続数の上限と、使っていない接続を保持する秒数
+GRAPHQL_POOL_SIZE = int(os.getenv("GRAPHQL_POOL_SIZE", "20"))
+GRAPHQL_KEEPALIVE = float(os.getenv("GRAPHQL_KEEPALIVE", "30"))
+
+if TYPE_CHECKING:
+    from gql import Client
+    from gql.client import AsyncClientSession
+
+_client: "Client | None" = None
+_session: "AsyncClientSession | None" = None
+_session_lock = asyncio.Lock()
+
+
+def get_client() -> "Client":
+    """
+    GraphQL クライアント (ワーカー毎に1つ、初回利用時に作る)
+    クエリはスキーマのスナップショットで検証するため、Hasura に接続できなくても起動できる
+    gql と aiohttp の import (約 100ms) も初回利用時 (lifespan) まで遅らせる
+    """
+    global _client
+    if _client is None:
+        from gql import Client
+        from gql.transport.aiohttp import AIOHTTPTransport
+
+        # Select your transport with a defined url endpoint
+        transport = AIOHTTPTransport(
+            url=os.environ.get("GRAPHQL_API_ENDPOINT"),
+            headers={
+                "x-hasura-admin-secret": os.environ.get("HASURA_GRAPHQL_ADMIN_SECRET"),
+                'content-type': 'application/json',
+            }
+        )
+        # Create a GraphQL client using the defined transport
+        _client = Client(
+            transport=transport,
+            schema=GRAPHQL_SCHEMA_PATH.read_text(),
+            fetch_schema_from_transport=False,
+        )
+        logger.info(f"GraphQL client created with schema {GRAPHQL_SCHEMA_PATH.name}")
+    return _client
+
+
+async def get_session() -> "AsyncClientSession":
+    """
+    ワーカー毎に1つの aiohttp のセッション (lifespan で開き、全てのリクエストで使い回す)
+    リクエスト毎に接続し直さず、接続プールの keep-alive の接続を再利用する
+    """
+    global _session
+    if _session is not None:
+        return _session
+    async with _session_lock:
+        if _session is None:
+            import aiohttp
+
+            client = get_client()
+            # 接続プールはイベントループの中で作る
+            client.transport.client_session_args = {
+                "connector": aiohttp.TCPConnector(
+                    limit=GRAPHQL_POOL_SIZE,
+                    keepalive_timeout=GRAPHQL_KEEPALIVE,
+                ),
+            }
+            _session = await client.connect_async()
+            logger.info(f"GraphQL session opened (pool size {GRAPHQL_POOL_SIZE})")
+    return _session
+
+
+async def execute(document: Document, variable_values=None):
+    """
+    登録済みの文書を実行する
+    文書は起動時に検証済みのため、gql の呼び出し毎の検証 (約 1ms) を省いてトランスポートに直接渡す
+    """
+    session = await get_session()
+    result = await asyncio.wait_for(
+        session.transport.execute(
+            document.node,
+            variable_values=variable_values,
+            operation_name=document.name,
+        ),
+        timeout=session.client.execute_timeout,
+    )
+    if result.errors:
+        from gql.transport.exceptions import TransportQueryError
+
+        raise TransportQueryError(
+            str(result.errors[0]),
+            errors=result.errors,
+            data=result.data,
+            extensions=result.extensions,
+        )
+    return result.data
+
+
+def check_documents():
+    """
+    登録済みの文書をスキーマのスナップショットで検証する (lifespan で1回だけ)
+    """
+    validate_documents(get_client().schema)
+
+
+async def close_client():
+    global _client, _session
+    if _session is not None:
+        await _client.close_async()
+        _session = None
+    _client = None
+
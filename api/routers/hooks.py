@@ -0,0 +1,71 @@
+import os
+import hmac
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from pydantic import BaseModel
+
+
+logger = logging.getLogger("uvicorn.app")
+
+# Hasura のイベントトリガーのヘッダー (x-webhook-secret) に設定する値、未設定の場合は全て拒否する
+HASURA_WEBHOOK_SECRET = os.getenv("HASURA_WEBHOOK_SECRET")
+
+
+router = APIRouter(
+    prefix="/hooks",
+    tags=["hooks"],
+    include_in_schema=True
+)
+
+
+class EventData(BaseModel):
+    old: Optional[dict] = None
+    new: Optional[dict] = None
+
+
+class Event(BaseModel):
+    op: str
+    data: EventData
+
+
+class EventTable(BaseModel):
+    name: str
+
+
+class HasuraEvent(BaseModel):
+    event: Event
+    table: EventTable
+
+
+@router.post("/survey_changed")
+async def survey_changed(
+    payload: HasuraEvent,
+    x_webhook_secret: Optional[str] = Header(None),
+):
+    """
+    surveys / student_preferences / student_dislikes / students のイベントトリガーから呼ばれ、
+    変更された行を含むアンケートのキャッシュを消す
+    """
+    if HASURA_WEBHOOK_SECRET is None or not hmac.compare_digest(x_webhook_secret or "", HASURA_WEBHOOK_SECRET):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook secret")
+
+    # NumPy を読み込むため、起動時ではなく初回の呼び出しで import する
+    from services.surveys import survey_cache
+
+    removed = []
+    for row in (payload.event.data.old, payload.event.data.new):
+        if not row:
+            continue
+        if payload.table.name == "surveys":
+            removed += survey_cache.invalidate(survey_id=row.get("id"))
+        elif payload.table.name == "student_preferences":
+            removed += survey_cache.invalidate(survey_id=row.get("survey_id"), preference_id=row.get("id"))
+        elif payload.table.name == "student_dislikes":
+            removed += survey_cache.invalidate(preference_id=row.get("preference_id"))
+        elif payload.table.name == "students":
+            removed += survey_cache.invalidate(student_id=row.get("id"))
+
+    logger.info(f"{payload.table.name} {payload.event.op}: invalidated surveys {sorted(set(removed))}")
+    return {"invalidated": sorted(set(removed))}
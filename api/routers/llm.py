@@ -1,39 +1,137 @@
 import os
 import json
+import asyncio
 import logging
-from openai import OpenAI
+import anyio
 from typing import Dict, Any
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, Depends, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 
-from models.match import Students, StudentPreferences
+from models.ingest import MappingSpec
+from models.match import Student, Students, StudentPreference, StudentPreferences
+from services.ingest import (
+    SpecError,
+    SpecApplier,
+    format_unmapped,
+    STREAM_SAMPLE_ROWS,
+    decode_csv,
+    iter_upload_text,
+    iter_records,
+    recognise_layout,
+    read_rows,
+    rows_to_csv,
+    format_known_layout,
+    format_with_spec,
+    uncovered_values,
+    check_spec,
+    spec_prompt,
+    positional_spec,
+    placeholder_content,
+)
+from services import llm
+from services.spec_cache import spec_cache
+from services.sessions import current_session
 
 
 logger = logging.getLogger("uvicorn.app")
 
+# 全ての行を LLM で変換する場合の1回あたりの行数と、チャンク毎のやり直し回数
+LLM_CHUNK_ROWS = int(os.getenv("LLM_CHUNK_ROWS", "40"))
+LLM_CHUNK_RETRIES = int(os.getenv("LLM_CHUNK_RETRIES", "2"))
+
 
 router = APIRouter(
     prefix="/llm",
     tags=["llm"],
-    include_in_schema=True
+    include_in_schema=True,
+    dependencies=[Depends(current_session)],
 )
 
-# OpenAIクライアントを初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+SPEC_SYSTEM_PROMPTS = {
+    "class": """
+    You are a data transformation expert. Your task is to map the columns of a CSV class roster
+    to the fields of a Student and return the mapping in the provided response format.
 
+    Fields (use exactly these names, one entry each):
+    - student_no: the student number. column = null if the column doesn't exist (the row number is used).
+    - name: the student name, or column = null.
+    - sex: values must be mapped as "男" → 1, "女" → 2. List every distinct value of the column in 'values'.
+    - memo: free text, or column = null.
 
-@router.post("/format_class")
-async def format_class(
-    file: UploadFile = File(...),
-) -> Students:
-    # CSVファイルの内容を読み込む
-    contents = await file.read()
+    'column' is the 0-based column index. kind must be "class".
+    """,
+    "survey": """
+    You are a data transformation expert. Your task is to map the columns of a CSV survey
+    to the fields of a StudentPreference and return the mapping in the provided response format.
+
+    Fields (use exactly these names, one entry each):
+    - student_id: the student number.
+    - previous_team: the current team number. default 0.
+    - mi_a, mi_b, mi_c, mi_d, mi_e, mi_f, mi_g, mi_h: the scores of A to H. default 0.
+    - leader: map "リーダーをがんばってみようかな" → 8, "サブリーダーをがんばってみようかな" → 3,
+      "リーダーサブリーダーはお任せしようかな" → 1. default 1.
+    - eyesight: map "はい！！目のかんけいで…" → 8, "あの、目のかんけいではないけど、できれば前がいいな…" → 3,
+      "いいえ、どこでもいいよ" → 1. default 1.
+    - student_dislikes: the column listing the student numbers the student should not be teamed with.
+
+    'column' is the 0-based column index, or null if no column matches.
+    For leader, eyesight and any other choice column list every distinct value in 'values'.
+    kind must be "survey".
+    """,
+}
+
+
+async def infer_spec(kind: str, header: list[str], rows: list[list[str]]) -> MappingSpec | None:
+    """
+    見出しと先頭の数行だけを LLM に渡し、列と値の対応表を作らせる
+    """
     try:
-        csv_text = contents.decode('utf-8')
-    except UnicodeDecodeError:
-        csv_text = contents.decode('cp932')
+        spec = await llm.parse(
+            SPEC_SYSTEM_PROMPTS[kind],
+            spec_prompt(header, rows),
+            MappingSpec,
+            stub=lambda: positional_spec(kind, header),
+        )
+    except Exception as e:
+        logger.error(f"Error inferring mapping spec: {str(e)}")
+        return None
+    if spec is None:
+        logger.info("Empty mapping spec")
+        return None
+    try:
+        check_spec(spec, kind, header)
+    except ValueError as e:
+        logger.info(f"Invalid mapping spec: {e}")
+        return None
+    logger.info(f"Mapping spec: {spec.model_dump_json()}")
+    return spec
+
+
+async def format_with_inferred_spec(csv_text: str, kind: str) -> Students | StudentPreferences | None:
+    rows = list(read_rows(csv_text))
+    if not rows:
+        return None
+    header, rows = rows[0], rows[1:]
+
+    # 同じレイアウトの対応表が保存されていれば LLM を使わない
+    spec = await spec_cache.get(kind, header, rows)
+    if spec is not None:
+        return format_with_spec(spec, rows)
 
-    # OpenAIのStructured Outputのプロンプトを作成
-    system_prompt = """
+    spec = await infer_spec(kind, header, rows)
+    if spec is None:
+        return None
+    content = format_with_spec(spec, rows)
+    # 対応表に無い値を既定値にした場合は、次のファイルで使い回さない
+    if content is not None and not uncovered_values(spec, rows) and llm.get_backend().cacheable:
+        await spec_cache.put(kind, header, spec)
+    return content
+
+
+# 全ての行を LLM で変換する場合のプロンプト
+CONVERT_SYSTEM_PROMPTS = {
+    "class": """
     You are a data transformation expert. Your task is to transform the given CSV data into a provided response format.
 
     Important rules for transformation:
@@ -47,47 +145,8 @@ async def format_class(
     3. For the 'student_no' field: Fill the row number as the value if the column doesn't exist.
     
     The output must strictly follow Students model structure.
-    """
-    user_prompt = f"""
-    Here is the sample data from the CSV:
-    {csv_text}
-    """
-    
-    # OpenAIのAPIを呼び出し
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        response_format=Students,
-    )
-    
-    # レスポンスを解析してJSONに変換
-    try:
-        content = completion.choices[0].message.parsed
-        logger.info(f"Response content: {json.dumps(content.dict(), ensure_ascii=False, indent=2)}")
-        return content
-    except Exception as e:
-        return {
-            "error": f"An error occurred: {str(e)}",
-            "completion": completion
-        }
-
-
-@router.post("/format_survey")
-async def format_survey(
-    file: UploadFile = File(...),
-) -> StudentPreferences:
-    # CSVファイルの内容を読み込む
-    contents = await file.read()
-    try:
-        csv_text = contents.decode('utf-8')
-    except UnicodeDecodeError:
-        csv_text = contents.decode('cp932')
-
-    # OpenAIのStructured Outputのプロンプトを作成
-    system_prompt = """
+    """,
+    "survey": """
     You are a data transformation expert. Your task is to transform the given CSV data into a provided response format.
 
     Important rules for transformation:
@@ -103,34 +162,270 @@ async def format_survey(
        - "いいえ、どこでもいいよ" → 1
     
     The output must strictly follow StudentPreferences model structure.
+    """,
+}
+
+RESPONSE_MODELS = {
+    "class": (Students, "students"),
+    "survey": (StudentPreferences, "preferences"),
+}
+
+
+async def convert_chunk(kind: str, header: list[str], rows: list[list[str]], start: int):
     """
+    見出しを付けた1つのチャンクを LLM で変換する
+    応答が空・行数が合わない・検証に失敗した場合は LLM_CHUNK_RETRIES 回までやり直す
+    """
+    model, field = RESPONSE_MODELS[kind]
     user_prompt = f"""
-    Here is the sample data from the CSV:
-    {csv_text}
+    Here is the sample data from the CSV (the first data row is row number {start}):
+    {rows_to_csv([header, *rows])}
     """
-    
-    # OpenAIのAPIを呼び出し
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        response_format=StudentPreferences,
+    for attempt in range(LLM_CHUNK_RETRIES + 1):
+        try:
+            content = await llm.parse(
+                CONVERT_SYSTEM_PROMPTS[kind],
+                user_prompt,
+                model,
+                # stub は位置で対応付けられないレイアウトでも、行数の合った結果を返す
+                stub=lambda: (
+                    format_with_spec(positional_spec(kind, header), rows)
+                    or placeholder_content(kind, len(rows), start)
+                ),
+            )
+            if content is None:
+                raise llm.LLMResponseError("Empty response")
+            # Students / StudentPreferences として検証し直し、行数が合っているか確かめる
+            content = model.model_validate(content.model_dump())
+            if len(getattr(content, field)) != len(rows):
+                raise llm.LLMResponseError(f"Expected {len(rows)} rows, got {len(getattr(content, field))}")
+            return content
+        except (llm.LLMResponseError, ValidationError) as e:
+            # 応答の誤りだけをやり直す (一時的なエラーは llm.parse がリトライ済み、それ以外はそのまま投げる)
+            if attempt == LLM_CHUNK_RETRIES:
+                raise llm.LLMResponseError(f"Rows {start}-{start + len(rows) - 1}: {str(e)}") from e
+            logger.warning(f"Chunk at row {start} failed ({str(e)}), retrying")
+
+
+async def convert_with_llm(kind: str, csv_text: str):
+    """
+    全ての行を LLM で変換する
+    行を見出し付きのチャンクに分けて並列に変換し (同時実行数は services.llm で制限される)、
+    元の順番で結合する
+    """
+    rows = list(read_rows(csv_text))
+    header, rows = rows[0], [row for row in rows[1:] if any(cell.strip() for cell in row)]
+    chunks = [
+        (rows[i:i + LLM_CHUNK_ROWS], i + 1)
+        for i in range(0, len(rows), LLM_CHUNK_ROWS)
+    ]
+    results = await asyncio.gather(
+        *[convert_chunk(kind, header, chunk, start) for chunk, start in chunks]
     )
-    
-    # レスポンスを解析してJSONに変換
-    try:
-        content = completion.choices[0].message.parsed
-        logger.info(f"Response content: {json.dumps(content.dict(), ensure_ascii=False, indent=2)}")
+
+    model, field = RESPONSE_MODELS[kind]
+    return model(**{field: [item for result in results for item in getattr(result, field)]})
+
+
+async def format_csv(file: UploadFile, kind: str):
+    # CSVファイルの内容を読み込む
+    contents = await file.read()
+    csv_text = decode_csv(contents)
+
+    # 空のファイルや見出しだけのファイルは LLM に渡さずに拒否する
+    rows = [row for row in read_rows(csv_text) if any(cell.strip() for cell in row)]
+    if not rows:
+        return JSONResponse(status_code=400, content={"error": "The file is empty"})
+    if len(rows) == 1:
+        return JSONResponse(status_code=400, content={"error": "The file has no data rows"})
+
+    # 既知のレイアウトなら LLM を使わずに変換する
+    content = format_known_layout(csv_text, kind)
+    if content is not None:
         return content
-    except Exception as e:
+
+    # 未知のレイアウトは見出しと数行から対応表だけを LLM に作らせ、変換は手元で行う
+    content = await format_with_inferred_spec(csv_text, kind)
+    if content is not None:
+        return content
+
+    # 対応表で変換できなかった場合は、全ての行を LLM で変換する
+    try:
+        content = await convert_with_llm(kind, csv_text)
+    except llm.LLMError as e:
+        logger.error(f"Error in LLM conversion: {str(e)}")
+        return JSONResponse(
+            status_code=502,
+            content={"error": f"An error occurred: {str(e)}"}
+        )
+
+    logger.info(f"Response content: {json.dumps(content.model_dump(), ensure_ascii=False, indent=2)}")
+    return content
+
+
+ROW_MODELS = {
+    "class": Student,
+    "survey": StudentPreference,
+}
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    リクエストボディを読みながら返す StreamingResponse
+    切断の検出のために receive を別に読むと本文の受信と競合するため、本文の読み込み (request.stream()) に任せる
+    """
+    media_type = "application/x-ndjson"
+
+    async def listen_for_disconnect(self, receive):
+        await anyio.sleep_forever()
+
+
+def ndjson(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+async def resolve_spec(kind: str, header: list[str], rows: list[list[str]]) -> tuple[MappingSpec | None, str | None]:
+    """
+    既知のレイアウト → 保存済みの対応表 → LLM の順に対応表を決め、(対応表, 決め方) を返す
+    """
+    spec = recognise_layout(header, kind)
+    if spec is not None:
+        return spec, "layout"
+    spec = await spec_cache.get(kind, header, rows)
+    if spec is not None:
+        return spec, "cache"
+    spec = await infer_spec(kind, header, rows)
+    if spec is not None:
+        return spec, "llm"
+    return None, None
+
+
+def validate_row(applier: SpecApplier, model, row: list[str], row_no: int, line: int) -> Dict[str, Any] | None:
+    """
+    1行を変換して検証し、row または error のイベントを返す (空行は None)
+    """
+    try:
+        record = applier.convert(row, row_no)
+        if record is None:
+            return None
+        return {"type": "row", "line": line, "data": model(**record).model_dump()}
+    except SpecError as e:
+        return {
+            "type": "error",
+            "line": line,
+            "errors": [{"field": e.field, "value": e.value, "message": e.message}],
+        }
+    except ValidationError as e:
         return {
-            "error": f"An error occurred: {str(e)}",
-            "completion": completion
+            "type": "error",
+            "line": line,
+            "errors": [
+                {"field": ".".join(str(loc) for loc in err["loc"]), "message": err["msg"]}
+                for err in e.errors()
+            ],
         }
 
 
+async def stream_csv(chunks, kind: str):
+    """
+    受信しながら1行ずつ変換・検証し、結果を NDJSON で返す
+    イベント:
+      {"type": "spec", "source": "layout" | "cache" | "llm", "columns": {...}}
+      {"type": "row", "line": 行番号, "data": Student / StudentPreference}
+      {"type": "error", "line": 行番号, "errors": [{"field", "message"}]}
+      {"type": "done", "rows": 変換できた行数, "errors": エラーの行数,
+       "unmapped": {フィールド: {対応表に無く既定値にした値: 件数}}}
+      {"type": "fatal", "error": ...} (ファイル全体を変換できない場合)
+    """
+    records = iter_records(iter_upload_text(chunks))
+    try:
+        # 対応表を決めるために先頭の数行だけ先読みする
+        header = None
+        sample = []
+        async for line, row in records:
+            if header is None:
+                header = row
+                continue
+            sample.append((line, row))
+            if len(sample) >= STREAM_SAMPLE_ROWS:
+                break
+        if header is None:
+            yield ndjson({"type": "fatal", "error": "Empty file"})
+            return
+
+        spec, source = await resolve_spec(kind, header, [row for _, row in sample])
+        if spec is None:
+            yield ndjson({"type": "fatal", "error": "Could not map the columns of the file"})
+            return
+        yield ndjson({
+            "type": "spec",
+            "source": source,
+            "columns": {m.field: m.column for m in spec.fields},
+        })
+
+        async def rest():
+            for item in sample:
+                yield item
+            async for item in records:
+                yield item
+
+        applier = SpecApplier(spec)
+        model = ROW_MODELS[kind]
+        rows = errors = 0
+        row_no = 0
+        async for line, row in rest():
+            row_no += 1
+            event = validate_row(applier, model, row, row_no, line)
+            if event is None:
+                continue
+            if event["type"] == "row":
+                rows += 1
+            else:
+                errors += 1
+            yield ndjson(event)
+
+        unmapped = format_unmapped(applier.unmapped)
+        if unmapped:
+            logger.warning(f"Values not in the mapping spec were set to the default: {unmapped}")
+        if source == "llm" and errors == 0 and not unmapped and llm.get_backend().cacheable:
+            await spec_cache.put(kind, header, spec)
+        yield ndjson({"type": "done", "rows": rows, "errors": errors, "unmapped": unmapped})
+    except UnicodeDecodeError as e:
+        logger.error(f"Error decoding upload: {str(e)}")
+        yield ndjson({"type": "fatal", "error": f"Could not decode the file: {str(e)}"})
+
+
+@router.post("/format_class")
+async def format_class(
+    file: UploadFile = File(...),
+) -> Students:
+    return await format_csv(file, "class")
+
+
+@router.post("/format_survey")
+async def format_survey(
+    file: UploadFile = File(...),
+) -> StudentPreferences:
+    return await format_csv(file, "survey")
+
+
+# multipart のアップロードは全て受信してからでないと読めないため、
+# ストリーミング版は CSV をそのままリクエストボディで受け取る (Content-Type: text/csv)
+@router.post("/format_class/stream")
+async def format_class_stream(request: Request) -> StreamingResponse:
+    return BodyStreamingResponse(stream_csv(request.stream(), "class"))
+
+
+@router.post("/format_survey/stream")
+async def format_survey_stream(request: Request) -> StreamingResponse:
+    return BodyStreamingResponse(stream_csv(request.stream(), "survey"))
+
+
+@router.get("/spec_cache")
+async def get_spec_cache_stats() -> Dict[str, Any]:
+    return spec_cache.stats()
+
+
 @router.post("/format_constraints")
 async def format_constraints(
     data: str = Form(...),
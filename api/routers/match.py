@@ -1,48 +1,197 @@
-from fastapi import APIRouter
+import json
+import time
+import logging
+from typing import TYPE_CHECKING
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 
-from models.match import MatchingRequest
-from services.match import (
-    matching,
-    # calc_mi_score,
-    # calc_sex_by_team,
-    # calc_previous_by_team,
-    # calc_dislikes_by_team,
-    calc_student_no_by_team
+from models.match import MatchingRequest, RotationRequest, SweepRequest
+from services.sessions import current_session
+from services.timings import Timings
+
+if TYPE_CHECKING:
+    from models.table import StudentTable
+
+logger = logging.getLogger("uvicorn.app")
+
+router = APIRouter(
+    prefix="/match",
+    tags=["match"],
+    include_in_schema=True,
+    dependencies=[Depends(current_session)],
 )
 
-router = APIRouter(prefix="/match", tags=["match"], include_in_schema=True)
+
+def log_timings(req: MatchingRequest, table: "StudentTable | None", status, timings: Timings):
+    """
+    1行の JSON で記録する (ログの検索・集計用)
+    """
+    logger.info(json.dumps({
+        "event": "match",
+        "survey_id": req.survey_id,
+        "students": None if table is None else len(table),
+        "max_num_teams": req.constraint.max_num_teams,
+        "status": None if status is None else status.name,
+        "timings_ms": timings.as_ms(),
+    }))
 
 
 @router.post("")
 @router.post("/")
-async def match(req: MatchingRequest):
-    teams, _, error = matching(req.student_constraints, req.constraint)
+async def match(req: MatchingRequest, request: Request, background_tasks: BackgroundTasks):
+    # NumPy・PuLP を使うモジュールは初回のリクエストまで読み込まない (起動時間を短くする)
+    from models.table import StudentTable
+    from services.match import matching, calc_team_report, calc_student_no_by_team
+    from services.surveys import survey_loader
+    from services.results import matching_result_name, save_matching_result
+
+    timings = Timings()
+    # リクエストの受信からハンドラーまで (本文の受信・JSON の解析・検証・セッションの確認)
+    received_ns = getattr(request.state, "received_ns", None)
+    if received_ns is not None:
+        timings.add("request", time.perf_counter_ns() - received_ns)
+
+    if req.save and req.survey_id is None:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "survey_id is required to save the result"}
+        )
+
+    with timings.span("load"):
+        if req.survey_id is not None:
+            # アンケートの回答を API で取得する
+            snapshot = await survey_loader.load(req.survey_id)
+            table = None if snapshot is None else snapshot.table
+        else:
+            table = StudentTable.from_request(req)
+    if table is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Survey not found"}
+        )
+    teams, status, error = matching(table, req.constraint, timings=timings, options=req.solver)
 
     if teams is None:
-        print(f"Error: {error}\nConstraint: {req.constraint}")
+        logger.error(f"Error: {error} Constraint: {req.constraint.model_dump_json()}")
+        log_timings(req, table, status, timings)
         return JSONResponse(
             status_code=400,
             content={"error": error}
         )
 
-    # mi_score_by_team = calc_mi_score(req.student_constraints, teams)
-    # sex_by_team = calc_sex_by_team(req.student_constraints, teams)
-    # previous_by_team = calc_previous_by_team(req.student_constraints, teams)
-    # dislikes_by_team = calc_dislikes_by_team(req.student_constraints, teams)
-    student_no_by_team = calc_student_no_by_team(req.student_constraints, teams)
+    with timings.span("report"):
+        report = calc_team_report(table, teams)
+        student_no_by_team = calc_student_no_by_team(table, teams)
+
+    content = {
+        # "students": req.student_constraints,
+        "teams": student_no_by_team,  # 0-index
+        "report": report,
+    }
+    if req.save:
+        # 保存はレスポンスを返した後に行う
+        name = matching_result_name(snapshot)
+        background_tasks.add_task(save_matching_result, snapshot, req.constraint, teams, name)
+        content["matching_result_name"] = name
+
+    with timings.span("encode"):
+        content = jsonable_encoder(content)
+    if req.timings:
+        # レスポンスの JSON の書き出し (render) はログにだけ記録する
+        content["timings"] = timings.as_ms()
+    with timings.span("render"):
+        response = JSONResponse(
+            status_code=200,
+            content=content
+        )
+    log_timings(req, table, status, timings)
+    return response
+
+
+@router.post("/rotation")
+async def rotation(req: RotationRequest):
+    from models.table import StudentTable
+    from services.match import calc_team_report, calc_student_no_by_team
+    from services.rotation import plan_rotation
+
+    table = StudentTable.from_constraints(req.student_constraints)
+    plans, _, error = await plan_rotation(
+        table, req.constraint, req.rounds, req.max_pair_meetings, req.solver
+    )
+
+    if error:
+        logger.error(f"Error: {error} Round: {len(plans)} Constraint: {req.constraint.model_dump_json()}")
+        return JSONResponse(
+            status_code=400,
+            content={"error": error, "round": len(plans)}
+        )
+
+    return JSONResponse(
+        status_code=200,
+        content=jsonable_encoder(
+            {
+                "rounds": [
+                    {
+                        "teams": calc_student_no_by_team(round_table, teams),  # 0-index
+                        "report": calc_team_report(round_table, teams),
+                    }
+                    for round_table, teams in plans
+                ],
+            }
+        )
+    )
+
+
+@router.post("/sweep")
+async def match_sweep(req: SweepRequest):
+    from models.table import StudentTable
+    from services.match import calc_team_report, calc_student_no_by_team
+    from services.sweep import candidate_configs, sweep, SWEEP_MAX_CANDIDATES
+
+    table = StudentTable.from_constraints(req.student_constraints)
+    configs = candidate_configs(
+        len(table),
+        req.min_num_teams,
+        req.max_num_teams,
+        req.min_members_per_team,
+        req.max_members_per_team,
+    )
+    if len(configs) > SWEEP_MAX_CANDIDATES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Too many configurations ({len(configs)}), narrow the ranges to at most {SWEEP_MAX_CANDIDATES}"}
+        )
+    best, candidates = await sweep(table, req.constraint, configs, req.solver)
+
+    summary = [
+        {
+            "num_teams": c.num_teams,
+            "members_per_team": c.members_per_team,
+            "state": c.state,
+            "reason": c.reason,
+            "score": c.score,
+        }
+        for c in candidates
+    ]
+
+    if best is None:
+        logger.error(f"Error: No feasible configuration Constraint: {req.constraint.model_dump_json()}")
+        return JSONResponse(
+            status_code=400,
+            content={"error": "No feasible configuration", "candidates": summary}
+        )
 
     return JSONResponse(
         status_code=200,
         content=jsonable_encoder(
             {
-                # "students": req.student_constraints,
-                "teams": student_no_by_team,  # 0-index
-                # "mi_score_by_team": mi_score_by_team,
-                # "sex_by_team": sex_by_team,
-                # "previous_by_team": previous_by_team,
-                # "dislikes_by_team": dislikes_by_team,
+                "num_teams": best.num_teams,
+                "members_per_team": best.members_per_team,
+                "teams": calc_student_no_by_team(table, best.teams),  # 0-index
+                "report": calc_team_report(table, best.teams),
+                "candidates": summary,
             }
         )
     )
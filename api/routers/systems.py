@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
-from .graphql import client, gql
+from .graphql import execute
+from .documents import GET_DB_VERSION
 import logging
 
 logger = logging.getLogger("uvicorn.app")
@@ -34,21 +35,7 @@ async def get_test_version():
     """
 
     logger.info("Retrieving database version")
-    
-    # Provide a GraphQL query
-    query = gql(
-        """
-        query getDbVersion {
-            goose_db_version {
-                id
-                is_applied
-                tstamp
-                version_id
-            }
-        }
-        """
-    )
 
     # Execute the query on the transport
-    result = await client.execute_async(query)
+    result = await execute(GET_DB_VERSION)
     return result["goose_db_version"]
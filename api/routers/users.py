@@ -4,11 +4,11 @@ from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import JSONResponse
-from .graphql import client, gql
+from .graphql import execute
+from .documents import GET_USER, GET_PASSWORD, UPDATE_TEACHER_PASSWORD, UPDATE_TEACHER, DELETE_USER
 
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from services.passwords import verify_password, hash_password
+from services.sessions import issue_token, SESSION_MAX_AGE
 
 
 router = APIRouter(prefix="/users", tags=["users"], include_in_schema=True)
@@ -28,6 +28,12 @@ class User(BaseModel):
     expired_at: Optional[datetime] = None
 
 
+class SignedInUser(User):
+    # 以降のリクエストの Authorization: Bearer に付けるトークン (SESSION_SECRET が未設定の場合は None)
+    token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+
 class SignInEndpoint(BaseModel):
     email: str
     password: str
@@ -44,40 +50,14 @@ class RenewPasswordEndpoint(BaseModel):
     password: str
 
 
-def verify(password: str, hashed: str):
-    salt = hashed[7:29]
-    return hashed == pwd_context.hash(password, salt=salt)
-
-
 @router.post("/signin", response_class=JSONResponse)
-async def signin(item: SignInEndpoint) -> Optional[User]:
+async def signin(item: SignInEndpoint) -> Optional[SignedInUser]:
     """
-    :return: User
+    :return: SignedInUser
     """
 
-    # Provide a GraphQL query
-    query = gql(
-        """
-        query getUser($email: String!) {
-            teachers(limit:1, where: {email: {_eq: $email}}) {
-              id
-              name
-              family_name
-              given_name
-              school_id
-              email
-              password
-              status
-              created_at
-              updated_at
-              expired_at
-            }
-        }
-        """
-    )
-
     # Execute the query on the transport
-    result = await client.execute_async(query, variable_values={"email": item.email})
+    result = await execute(GET_USER, variable_values={"email": item.email})
 
     users = result["teachers"]
 
@@ -88,12 +68,17 @@ async def signin(item: SignInEndpoint) -> Optional[User]:
 
     user = users[0]
 
-    if not verify(item.password, user["password"]):
+    if not await verify_password(item.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Unauthorized"
         )
 
-    return User(**{k: v for k, v in user.items() if k != "password"})
+    token = issue_token(user["id"], user["email"])
+    return SignedInUser(
+        **{k: v for k, v in user.items() if k != "password"},
+        token=token,
+        expires_in=SESSION_MAX_AGE if token else None,
+    )
 
 
 @router.post("/password", response_class=JSONResponse)
@@ -102,20 +87,9 @@ async def update_password(item: UpdatePasswordEndpoint) -> bool:
     :return: User
     """
 
-    query = gql(
-        """
-        query getPassword($user_id: bigint!) {
-            teachers_by_pk(id: $user_id) {
-              id
-              password
-            }
-        }
-        """
-    )
-
     # Execute the query on the transport
-    result = await client.execute_async(
-        query, variable_values={"user_id": item.user_id}
+    result = await execute(
+        GET_PASSWORD, variable_values={"user_id": item.user_id}
     )
 
     user = result["teachers_by_pk"]
@@ -125,39 +99,17 @@ async def update_password(item: UpdatePasswordEndpoint) -> bool:
             status_code=status.HTTP_401_UNAUTHORIZED, detail="No user by the email"
         )
 
-    if not verify(item.old_password, user["password"]):
+    if not await verify_password(item.old_password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Unauthorized by the old password",
         )
 
-    encrypted_password = pwd_context.hash(item.new_password)
-
-    query = gql(
-        """
-        mutation updateTeacher(
-          $user_id: bigint!,
-          $encrypted_password: String,
-          $updated_at: timestamp,
-        ) {
-            update_teachers_by_pk(
-              pk_columns: {id: $user_id}, 
-              _set: {
-                password: $encrypted_password,
-                updated_at: $updated_at
-              }
-            ) {
-              id
-              password
-              updated_at
-            }
-        }
-        """
-    )
+    encrypted_password = await hash_password(item.new_password)
 
     # Execute the query on the transport
-    result = await client.execute_async(
-        query,
+    result = await execute(
+        UPDATE_TEACHER_PASSWORD,
         variable_values={
             "user_id": item.user_id,
             "encrypted_password": encrypted_password,
@@ -181,7 +133,7 @@ async def update_password(item: RenewPasswordEndpoint):
     """
     :return: str
     """
-    return {"hash": pwd_context.hash(item.password)}
+    return {"hash": await hash_password(item.password)}
 
 
 @router.patch("/user", response_class=JSONResponse)
@@ -190,47 +142,9 @@ async def update(user: User) -> User:
     :return: User
     """
 
-    # Provide a GraphQL query
-    query = gql(
-        """
-        mutation updateTeacher(
-          $user_id: bigint!,
-          $name: String,
-          $family_name: String,
-          $given_name: String,
-          $school_id: bigint,
-          $status: Int,
-          $updated_at: timestamp,
-        ) {
-            update_teachers_by_pk(
-              pk_columns: {id: $user_id}, 
-              _set: {
-                name: $name,
-                family_name: $family_name,
-                given_name: $given_name,
-                school_id: $school_id,
-                status: $status,
-                updated_at: $updated_at
-              }
-            ) {
-              id
-              name
-              family_name
-              given_name
-              school_id
-              email
-              status
-              created_at
-              updated_at
-              expired_at
-            }
-        }
-        """
-    )
-
     # Execute the query on the transport
-    result = await client.execute_async(
-        query,
+    result = await execute(
+        UPDATE_TEACHER,
         variable_values={
             "user_id": user.id,
             "name": user.name,
@@ -253,23 +167,8 @@ async def delete(user_id: int) -> bool:
     :return: bool
     """
 
-    # Provide a GraphQL query
-    query = gql(
-        """
-        mutation deleteUser(
-          $user_id: bigint!,
-        ) {
-            delete_teachers_by_pk(
-              id: $user_id
-            ) {
-                id
-            }
-        }
-        """
-    )
-
     # Execute the query on the transport
-    result = await client.execute_async(query, variable_values={"user_id": user_id})
+    result = await execute(DELETE_USER, variable_values={"user_id": user_id})
 
     deleted_user = result["delete_teachers_by_pk"]
 
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def previous_adjacency(previous: np.ndarray) -> np.ndarray:
+    """
+    前回同じチームだった生徒同士を結ぶ隣接行列 (bool, n×n)
+    前回のチームが無い生徒 (負の値) は誰とも結ばない
+    """
+    same = (previous[:, None] == previous[None, :]) & (previous[:, None] >= 0)
+    np.fill_diagonal(same, False)
+    return same
+
+
+def clique_cover(adjacency: np.ndarray) -> list[np.ndarray]:
+    """
+    全ての辺をいずれかのクリークで覆うクリークの集合を貪欲法で求める
+
+    クリーク C に対する制約 sum_{i in C} x[i,t] <= 1 は
+    C 内の全てのペア制約 x[i,t] + x[j,t] <= 1 を含み、かつ LP 緩和としてより強い
+    """
+    # 自己ループ (対角) があると候補から自分自身が消えず終わらないため、対角を除いた写しで求める
+    adjacency = adjacency.copy()
+    np.fill_diagonal(adjacency, False)
+    uncovered = adjacency.copy()
+    cliques = []
+    while uncovered.any():
+        # 未被覆の辺が最も多い頂点を起点にする
+        seed = int(np.argmax(uncovered.sum(axis=1)))
+        clique = [seed]
+        candidates = adjacency[seed].copy()
+        candidates[seed] = False
+        while candidates.any():
+            # 未被覆の辺を多く覆える頂点を優先し、同点なら候補内の次数が大きい頂点を選ぶ
+            gain = uncovered[clique].sum(axis=0)
+            degree = (adjacency & candidates).sum(axis=1)
+            score = np.where(candidates, gain * (len(adjacency) + 1) + degree, -1)
+            v = int(np.argmax(score))
+            clique.append(v)
+            candidates &= adjacency[v]
+        members = np.array(sorted(clique), dtype=np.int64)
+        uncovered[np.ix_(members, members)] = False
+        cliques.append(members)
+    return cliques
+
+
+def previous_groups(previous: np.ndarray, limit: int) -> list[np.ndarray]:
+    """
+    前回のチーム毎に生徒をまとめる
+    前回のチームが無い生徒 (負の値) と、人数が limit 以下で制約が自明に満たされるグループは除く
+    """
+    valid = previous >= 0
+    groups = []
+    for prev_team in np.unique(previous[valid]):
+        members = np.flatnonzero(previous == prev_team)
+        if len(members) > limit:
+            groups.append(members)
+    return groups
@@ -0,0 +1,483 @@
+import csv
+import io
+import codecs
+import hashlib
+import re
+import logging
+import unicodedata
+from collections import Counter
+from typing import AsyncIterator, Iterable, Iterator
+
+from pydantic import ValidationError
+
+from models.ingest import ValueMapping, FieldMapping, MappingSpec
+from models.match import Student, Students, StudentPreference, StudentPreferences
+
+logger = logging.getLogger(__name__)
+
+
+class SpecError(ValueError):
+    """
+    対応表で変換できない行があった場合のエラー
+    """
+    def __init__(self, line: int, field: str, value: str, message: str):
+        self.line = line
+        self.field = field
+        self.value = value
+        self.message = message
+        super().__init__(f"line {line}: {field}={value!r}: {message}")
+
+
+# フィールドの種類: int (数値), str (文字列), list (名簿番号のリスト)
+FIELD_TYPES = {
+    "class": {
+        "student_no": int,
+        "name": str,
+        "sex": int,
+        "memo": str,
+    },
+    "survey": {
+        "student_id": int,
+        "previous_team": int,
+        "mi_a": int,
+        "mi_b": int,
+        "mi_c": int,
+        "mi_d": int,
+        "mi_e": int,
+        "mi_f": int,
+        "mi_g": int,
+        "mi_h": int,
+        "leader": int,
+        "eyesight": int,
+        "student_dislikes": list,
+    },
+}
+
+# 既知のレイアウトで使われている回答の対応表 (プロンプトと bkp/requests/gen.py に書かれているもの)
+SEX_VALUES = {
+    "男": 1,
+    "男子": 1,
+    "女": 2,
+    "女子": 2,
+}
+LEADER_VALUES = {
+    "リーダーをがんばってみようかな": 8,
+    "サブリーダーをがんばってみようかな": 3,
+    "リーダーサブリーダーはお任せしようかな": 1,
+    "リーダー（チームやクラスのために）": 8,
+    "サブリーダー（リーダーを支える）": 3,
+    "上の２つ以外": 1,
+}
+EYESIGHT_VALUES = {
+    "はい！！目のかんけいで…": 8,
+    "あの、目のかんけいではないけど、できれば前がいいな…": 3,
+    "いいえ、どこでもいいよ": 1,
+}
+
+# 既知のレイアウトの見出しのキーワード (正規化した見出しに対する正規表現)
+HEADER_PATTERNS = {
+    "class": {
+        "student_no": r"名簿番号|出席番号|^番号|student_no",
+        "name": r"氏名|名前|^name",
+        "sex": r"性別|^sex",
+        "memo": r"メモ|備考|^memo",
+    },
+    "survey": {
+        "student_id": r"名簿番号|出席番号|student_id",
+        "previous_team": r"何班|前回|previous",
+        **{f"mi_{c}": rf"^{c.upper()}の数字|^mi_{c}$" for c in "abcdefgh"},
+        "leader": r"役割|リーダー|^leader",
+        "eyesight": r"目のかんけい|視力|前の席|^eyesight",
+        "student_dislikes": r"いっしょはダメ|遊んじゃいそう|dislike",
+    },
+}
+
+# 既知のレイアウトとみなすために必要なフィールド
+REQUIRED_FIELDS = {
+    "class": {"sex"},
+    "survey": {"student_id", "previous_team", *[f"mi_{c}" for c in "abcdefgh"]},
+}
+
+DEFAULTS = {
+    "class": {},
+    "survey": {
+        "previous_team": 0,
+        **{f"mi_{c}": 0 for c in "abcdefgh"},
+        "leader": 1,
+        "eyesight": 1,
+    },
+}
+
+VALUE_MAPS = {
+    "sex": SEX_VALUES,
+    "leader": LEADER_VALUES,
+    "eyesight": EYESIGHT_VALUES,
+}
+
+# Google Forms のテスト形式で付く採点用の列
+IGNORED_HEADER_PREFIXES = ("点数 - ", "フィードバック - ")
+
+LIST_SEPARATORS = re.compile(r"[,、・\s]+")
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+def decode_csv(contents: bytes) -> str:
+    try:
+        return contents.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return contents.decode("cp932")
+
+
+async def iter_upload_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    受信したバイト列を届いた順に文字列にする
+    文字コードは最初のチャンクで判定する (UTF-8 で読めなければ cp932)
+    """
+    decoder = None
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder("utf-8-sig")()
+            try:
+                yield decoder.decode(chunk)
+                continue
+            except UnicodeDecodeError:
+                decoder = codecs.getincrementaldecoder("cp932")()
+        yield decoder.decode(chunk)
+    if decoder is not None:
+        yield decoder.decode(b"", final=True)
+
+
+async def iter_records(texts: AsyncIterator[str]) -> AsyncIterator[tuple[int, list[str]]]:
+    """
+    文字列のチャンクから CSV のレコードを1つずつ取り出し、(開始行, レコード) を返す
+    引用符の中の改行を含むレコードは、引用符が閉じるまで行をまとめる
+    """
+    buffer = ""
+    pending = ""
+    line = 0
+    start = 1
+
+    def parse(text: str) -> list[str]:
+        return next(csv.reader(io.StringIO(text)), [])
+
+    async for text in texts:
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for part in lines:
+            line += 1
+            if not pending:
+                start = line
+            pending += part + "\n"
+            # 引用符の数が奇数の間はレコードが続いている
+            if pending.count('"') % 2 == 0:
+                yield start, parse(pending)
+                pending = ""
+    if pending or buffer:
+        yield (start if pending else line + 1), parse(pending + buffer)
+
+
+def read_rows(csv_text: str) -> Iterator[list[str]]:
+    return csv.reader(io.StringIO(csv_text))
+
+
+def rows_to_csv(rows: list[list[str]]) -> str:
+    out = io.StringIO()
+    csv.writer(out).writerows(rows)
+    return out.getvalue()
+
+
+def recognise_layout(header: list[str], kind: str) -> MappingSpec | None:
+    """
+    見出しから既知のレイアウト (Google Forms のアンケートや名簿) を判定し、対応表を作る
+    判定できない場合は None を返す
+    """
+    columns = {}
+    for field, pattern in HEADER_PATTERNS[kind].items():
+        for column, title in enumerate(header):
+            if title.startswith(IGNORED_HEADER_PREFIXES):
+                continue
+            if re.search(pattern, normalize(title), flags=re.IGNORECASE):
+                columns[field] = column
+                break
+
+    if not REQUIRED_FIELDS[kind] <= columns.keys():
+        return None
+
+    return MappingSpec(
+        kind=kind,
+        fields=[
+            FieldMapping(
+                field=field,
+                column=columns.get(field),
+                values=[
+                    ValueMapping(source=source, target=target)
+                    for source, target in VALUE_MAPS.get(field, {}).items()
+                ],
+                default=DEFAULTS[kind].get(field),
+            )
+            for field in FIELD_TYPES[kind]
+        ],
+    )
+
+
+def convert_value(mapping: FieldMapping, field_type: type, raw: str, line: int) -> tuple[object, bool]:
+    """
+    1つの値を変換する
+    :return: (値, 対応表に無く数値でもないため既定値にしたか)
+    """
+    value = normalize(raw)
+    if field_type is str:
+        return value or None, False
+    if field_type is list:
+        return [int(v) for v in LIST_SEPARATORS.split(value) if v.isdigit()], False
+
+    if value == "":
+        if mapping.default is None:
+            raise SpecError(line, mapping.field, raw, "empty value")
+        return mapping.default, False
+    for v in mapping.values:
+        if normalize(v.source) == value:
+            return v.target, False
+    try:
+        return int(float(value)), False
+    except ValueError:
+        if mapping.default is None:
+            raise SpecError(line, mapping.field, raw, "unknown value")
+        return mapping.default, True
+
+
+class SpecApplier:
+    """
+    対応表を適用する (ファイル全体は列毎に apply、ストリーミングは1行ずつ convert)
+    同じ値の変換は列毎に1回だけ行う
+    対応表に無い値を既定値にした場合は、フィールドと値毎の件数を unmapped に数える
+    """
+
+    def __init__(self, spec: MappingSpec):
+        self.spec = spec
+        self.field_types = FIELD_TYPES[spec.kind]
+        self.caches = {m.field: {} for m in spec.fields}
+        self.unmapped: dict[str, Counter] = {}
+
+    def _value(self, mapping: FieldMapping, raw: str, line: int):
+        cache = self.caches[mapping.field]
+        if raw not in cache:
+            cache[raw] = convert_value(mapping, self.field_types[mapping.field], raw, line)
+        value, unmapped = cache[raw]
+        if unmapped:
+            self.unmapped.setdefault(mapping.field, Counter())[normalize(raw)] += 1
+        return value
+
+    def _missing_column(self, mapping: FieldMapping, row_no: int):
+        field_type = self.field_types[mapping.field]
+        if mapping.field in ("student_no", "student_id"):
+            # 名簿番号の列が無い場合は行番号を使う
+            return row_no
+        if field_type is list:
+            return []
+        if field_type is str:
+            return None
+        return mapping.default
+
+    def convert(self, row: list[str], row_no: int) -> dict | None:
+        """
+        row_no は見出しを除いた 1 始まりの行番号、空行の場合は None を返す
+        """
+        if not any(cell.strip() for cell in row):
+            return None
+        record = {}
+        for mapping in self.spec.fields:
+            if mapping.column is None:
+                record[mapping.field] = self._missing_column(mapping, row_no)
+                continue
+            raw = row[mapping.column] if mapping.column < len(row) else ""
+            value = self._value(mapping, raw, row_no + 1)
+            record[mapping.field] = list(value) if self.field_types[mapping.field] is list else value
+        return record
+
+    def apply(self, rows: Iterable[list[str]]) -> list[dict]:
+        """
+        見出しを除いた全ての行を列毎に変換し、フィールド名の dict の行にする (空行は除く)
+        """
+        numbered = [
+            (row_no, row) for row_no, row in enumerate(rows, start=1)
+            if any(cell.strip() for cell in row)
+        ]
+        columns = {}
+        for mapping in self.spec.fields:
+            if mapping.column is None:
+                columns[mapping.field] = [self._missing_column(mapping, row_no) for row_no, _ in numbered]
+                continue
+            column = mapping.column
+            values = [
+                self._value(mapping, row[column] if column < len(row) else "", row_no + 1)
+                for row_no, row in numbered
+            ]
+            if self.field_types[mapping.field] is list:
+                values = [list(value) for value in values]
+            columns[mapping.field] = values
+        return [dict(zip(columns, record)) for record in zip(*columns.values())]
+
+
+# LLM に見せる行数
+SAMPLE_ROWS = 5
+# ストリーミングで対応表を決めるために先読みする行数
+STREAM_SAMPLE_ROWS = 50
+# これ以下の種類の値しか無い文字列の列は、選択式の回答とみなして値の一覧を LLM に見せる
+MAX_CATEGORIES = 12
+
+
+def positional_spec(kind: str, header: list[str]) -> MappingSpec:
+    """
+    フィールドを見出しの先頭の列から順に割り当てた対応表
+    LLM を使わない stub バックエンドの応答に使う
+    """
+    return MappingSpec(
+        kind=kind,
+        fields=[
+            FieldMapping(
+                field=field,
+                column=column if column < len(header) else None,
+                values=[
+                    ValueMapping(source=source, target=target)
+                    for source, target in VALUE_MAPS.get(field, {}).items()
+                ],
+                default=DEFAULTS[kind].get(field),
+            )
+            for column, field in enumerate(FIELD_TYPES[kind])
+        ],
+    )
+
+
+def placeholder_content(kind: str, num_rows: int, start: int = 1) -> Students | StudentPreferences:
+    """
+    行数だけが正しい変換結果 (番号は start からの行番号、それ以外は既定値)
+    positional_spec で変換できないレイアウトでの stub バックエンドの応答に使う
+    """
+    if kind == "class":
+        return Students(students=[
+            Student(student_no=start + i, name=None, sex=1, memo=None) for i in range(num_rows)
+        ])
+    return StudentPreferences(preferences=[
+        StudentPreference(student_id=start + i, student_dislikes=[], **DEFAULTS["survey"])
+        for i in range(num_rows)
+    ])
+
+
+def check_spec(spec: MappingSpec, kind: str, header: list[str]):
+    """
+    LLM が作った対応表がフィールド名・列番号として正しいか確かめる
+    """
+    fields = {m.field for m in spec.fields}
+    if spec.kind != kind:
+        raise ValueError(f"Unexpected kind: {spec.kind}")
+    if unknown := fields - FIELD_TYPES[kind].keys():
+        raise ValueError(f"Unknown fields: {sorted(unknown)}")
+    if missing := FIELD_TYPES[kind].keys() - fields:
+        raise ValueError(f"Missing fields: {sorted(missing)}")
+    for m in spec.fields:
+        if m.column is not None and not 0 <= m.column < len(header):
+            raise ValueError(f"Column out of range: {m.field}={m.column}")
+
+
+def categorical_values(header: list[str], rows: list[list[str]]) -> dict[int, list[str]]:
+    """
+    数値ではない値が MAX_CATEGORIES 種類以下の列と、その値の一覧
+    """
+    categories = {}
+    for column in range(len(header)):
+        values = set()
+        for row in rows:
+            value = normalize(row[column]) if column < len(row) else ""
+            if value and not LIST_SEPARATORS.sub("", value).isdigit():
+                values.add(value)
+                if len(values) > MAX_CATEGORIES:
+                    break
+        if 0 < len(values) <= MAX_CATEGORIES:
+            categories[column] = sorted(values)
+    return categories
+
+
+def spec_prompt(header: list[str], rows: list[list[str]]) -> str:
+    """
+    見出しと先頭の数行、選択式の列の値の一覧だけを LLM に渡す (行数に依存しない大きさ)
+    """
+    lines = ["Header (column index: title):"]
+    lines += [f"{i}: {title}" for i, title in enumerate(header)]
+    lines += ["", f"First {min(SAMPLE_ROWS, len(rows))} rows:"]
+    lines += [rows_to_csv(rows[:SAMPLE_ROWS])]
+    lines += ["Distinct values of choice columns:"]
+    lines += [f"{i}: {values}" for i, values in categorical_values(header, rows).items()]
+    return "\n".join(lines)
+
+
+def header_fingerprint(kind: str, header: list[str]) -> str:
+    """
+    正規化した見出しの行のハッシュ (毎月同じ Google Forms から出力した CSV は同じ値になる)
+    """
+    titles = [normalize(title).lower() for title in header]
+    while titles and titles[-1] == "":
+        titles.pop()
+    return hashlib.sha256("\x1f".join([kind, *titles]).encode()).hexdigest()
+
+
+def uncovered_values(spec: MappingSpec, rows: list[list[str]]) -> set[str]:
+    """
+    対応表を持つ列の値のうち、対応表に無く数値でもない値
+    キャッシュした対応表を別のファイルに使えるかの判定に使う
+    """
+    uncovered = set()
+    for mapping in spec.fields:
+        if mapping.column is None or not mapping.values:
+            continue
+        sources = {normalize(v.source) for v in mapping.values}
+        for row in rows:
+            value = normalize(row[mapping.column]) if mapping.column < len(row) else ""
+            if value and value not in sources and not value.lstrip("-").isdigit():
+                uncovered.add(value)
+    return uncovered
+
+
+def format_unmapped(unmapped: dict[str, Counter]) -> dict[str, dict[str, int]]:
+    """
+    SpecApplier.unmapped を JSON にできる形にする
+    """
+    return {field: dict(counts) for field, counts in unmapped.items()}
+
+
+def format_with_spec(spec: MappingSpec, rows: Iterable[list[str]]) -> Students | StudentPreferences | None:
+    """
+    対応表を全ての行に適用する
+    変換できない値があった場合は None を返す
+    """
+    applier = SpecApplier(spec)
+    try:
+        records = applier.apply(rows)
+        if applier.unmapped:
+            logger.warning(f"Values not in the mapping spec were set to the default: {format_unmapped(applier.unmapped)}")
+        if spec.kind == "class":
+            return Students(students=[Student(**r) for r in records])
+        return StudentPreferences(preferences=[StudentPreference(**r) for r in records])
+    except (SpecError, ValidationError) as e:
+        logger.info(f"Mapping spec could not be applied: {e}")
+        return None
+
+
+def format_known_layout(csv_text: str, kind: str) -> Students | StudentPreferences | None:
+    """
+    既知のレイアウトの CSV を LLM を使わずに変換する
+    レイアウトを判定できない場合や変換できない値があった場合は None を返す
+    """
+    rows = read_rows(csv_text)
+    header = next(rows, None)
+    if header is None:
+        return None
+    spec = recognise_layout(header, kind)
+    if spec is None:
+        return None
+    return format_with_spec(spec, rows)
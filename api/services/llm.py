@@ -0,0 +1,192 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Callable, TypeVar
+
+from pydantic import BaseModel
+
+from services.metrics import LLM_SECONDS, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+# openai (OpenAI API) または stub (オフラインの負荷試験用)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# 1回の呼び出しのタイムアウト (秒)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# ワーカー毎の同時呼び出し数の上限
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# stub の応答にかかる時間 (ミリ秒)
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "0"))
+
+
+class LLMError(Exception):
+    """
+    LLM のバックエンドが失敗した (リトライしても失敗した一時的なエラーを含む)
+    """
+
+
+class LLMResponseError(LLMError):
+    """
+    LLM の応答が使えない (空の応答、行数の不一致など)
+    """
+
+
+class LLMBackend:
+    # メトリクスのラベルに使う名前
+    name: str = "unknown"
+    # リトライしてよい例外
+    retryable: tuple[type[Exception], ...] = (asyncio.TimeoutError,)
+    # バックエンドの失敗を表す例外 (LLMError にして呼び出し元に返す)、それ以外の例外はそのまま投げる
+    errors: tuple[type[Exception], ...] = (asyncio.TimeoutError,)
+    # False の場合、このバックエンドの結果を対応表のキャッシュ (services.spec_cache) に保存しない
+    cacheable: bool = True
+
+    async def parse(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        response_format: type[T],
+        stub: Callable[[], T] | None = None,
+    ) -> T:
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self):
+        from openai import (
+            AsyncOpenAI,
+            OpenAIError,
+            APIConnectionError,
+            APITimeoutError,
+            InternalServerError,
+            RateLimitError,
+        )
+
+        # リトライとタイムアウトはこのモジュールで管理する
+        try:
+            self.client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=LLM_TIMEOUT,
+                max_retries=0,
+            )
+        except OpenAIError as e:
+            raise LLMError(str(e)) from e
+        self.errors = (asyncio.TimeoutError, OpenAIError)
+        self.retryable = (
+            asyncio.TimeoutError,
+            APIConnectionError,
+            APITimeoutError,
+            InternalServerError,
+            RateLimitError,
+        )
+
+    async def parse(self, system_prompt, user_prompt, response_format, stub=None):
+        completion = await self.client.beta.chat.completions.parse(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            response_format=response_format,
+        )
+        if completion.usage is not None:
+            LLM_TOKENS.inc(completion.usage.prompt_tokens, model=LLM_MODEL, kind="prompt")
+            LLM_TOKENS.inc(completion.usage.completion_tokens, model=LLM_MODEL, kind="completion")
+        return completion.choices[0].message.parsed
+
+
+class StubBackend(LLMBackend):
+    """
+    OpenAI を呼ばずに、呼び出し元が渡した stub の結果を返す
+    (stub が無い場合は response_format の既定値) 取り込み処理の負荷試験に使う
+    結果は LLM が作ったものではないため、対応表のキャッシュには保存しない
+    """
+    name = "stub"
+    cacheable = False
+
+    def __init__(self, latency_ms: float = LLM_STUB_LATENCY_MS):
+        self.latency = latency_ms / 1000
+
+    async def parse(self, system_prompt, user_prompt, response_format, stub=None):
+        await asyncio.sleep(self.latency)
+        if stub is None:
+            return response_format.model_construct()
+        result = stub()
+        if result is None:
+            raise LLMResponseError(f"The stub did not produce a {response_format.__name__}")
+        return result
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "stub": StubBackend,
+}
+
+_backend: LLMBackend | None = None
+_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[LLM_BACKEND]()
+    return _backend
+
+
+def set_backend(backend: LLMBackend):
+    """
+    バックエンドを差し替える (負荷試験など)
+    """
+    global _backend
+    _backend = backend
+
+
+async def parse(
+    system_prompt: str,
+    user_prompt: str,
+    response_format: type[T],
+    stub: Callable[[], T] | None = None,
+) -> T:
+    """
+    Structured Output で LLM を呼び出す
+    同時呼び出し数を LLM_CONCURRENCY に抑え、1回毎に LLM_TIMEOUT でタイムアウトさせ、
+    一時的なエラーは指数バックオフ (full jitter) で LLM_MAX_RETRIES 回までリトライする
+    バックエンドの失敗は LLMError として投げる
+    """
+    backend = get_backend()
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with _semaphore:
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    result = await asyncio.wait_for(
+                        backend.parse(system_prompt, user_prompt, response_format, stub),
+                        timeout=LLM_TIMEOUT,
+                    )
+                    outcome = "ok"
+                    return result
+                except backend.retryable:
+                    outcome = "retryable_error"
+                    raise
+                finally:
+                    LLM_SECONDS.observe(time.perf_counter() - start, backend=backend.name, outcome=outcome)
+        except backend.retryable as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise LLMError(f"{type(e).__name__}: {str(e)}") from e
+            # 待っている間は同時呼び出しの枠を空けておく
+            delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        except backend.errors as e:
+            raise LLMError(f"{type(e).__name__}: {str(e)}") from e
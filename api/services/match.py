@@ -1,11 +1,29 @@
+import os
+import json
+import time
 import logging
 from enum import Enum
-from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpBinary, PULP_CBC_CMD, LpInteger, LpStatus
 
-from models.match import StudentConstraint, Constraint
+import numpy as np
+
+from models.match import Constraint, SolverOptions
+from models.table import StudentTable, MI_CATEGORIES
+from services.cliques import (
+    previous_adjacency,
+    clique_cover,
+    previous_groups,
+)
+from services.timings import Timings
+from services.metrics import SOLVE_SECONDS, SOLVE_NODES, SOLVE_GAP, MODEL_VARIABLES, MODEL_CONSTRAINTS
+from services.solver_log import SolverProgress, capture_log, parse_cbc_log
 
 logger = logging.getLogger(__name__)
 
+# 1回の求解の時間の上限 (秒、経過時間)
+SOLVER_TIME_LIMIT = float(os.getenv("SOLVER_TIME_LIMIT", "60"))
+# deterministic の場合の探索ノード数の上限 (時間の上限は安全のために残す)
+SOLVER_DETERMINISTIC_MAX_NODES = int(os.getenv("SOLVER_DETERMINISTIC_MAX_NODES", "100000"))
+
 
 class LpStatusType(Enum):
     # pulp.LpStatus
@@ -17,262 +35,343 @@ class LpStatusType(Enum):
     FEASIBLE = 2
 
 
-# def calc_mi_score(students, teams):
-#     if teams is None:
-#         return None
-
-#     # スコアの合計を計算する
-#     categories = ["mi_a", "mi_b", "mi_c", "mi_d", "mi_e", "mi_f", "mi_g", "mi_h"]
-#     team_scores = {team: [0.0] * (len(categories)) for team in teams}
-
-#     for team, members in teams.items():
-#         for member in members:
-#             for i, cat in enumerate(categories):
-#                 team_scores[team][i] += getattr(students[member], cat)
-
-#     return team_scores
-
-
-# def calc_sex_by_team(students, teams):
-#     if teams is None:
-#         return None
-
-#     # チーム毎の性別を計算する
-#     team_sexes = {team: [] for team in teams}
-#     for team, members in teams.items():
-#         for member in members:
-#             team_sexes[team].append(students[member].sex)
-#     return team_sexes
+def team_of_students(teams, num_students: int) -> np.ndarray:
+    """
+    チーム割り当て {team: [生徒]} を生徒毎のチーム番号の配列 (n,) にする
+    """
+    team_of = np.full(num_students, -1, dtype=np.int64)
+    for t, members in teams.items():
+        team_of[np.asarray(members, dtype=np.int64)] = t
+    return team_of
 
 
-# def calc_previous_by_team(students, teams):
-#     if teams is None:
-#         return None
-
-#     # チーム毎の前回のチームを計算する
-#     team_previous = {team: [] for team in teams}
-#     for team, members in teams.items():
-#         for member in members:
-#             team_previous[team].append(students[member].previous)
-#     return team_previous
-
-
-# def calc_dislikes_by_team(students, teams):
-#     if teams is None:
-#         return None
-
-#     # チーム毎の嫌いな生徒を計算する
-#     team_dislikes = {team: [] for team in teams}
-#     for team, members in teams.items():
-#         team_dislikes[team] = []
-#         for member in members:
-#             team_dislikes[team] += [students[member].dislikes]
-#     return team_dislikes
-
-
-def calc_student_no_by_team(students, teams):
+def calc_team_report(table: StudentTable, teams):
     if teams is None:
         return None
 
-    # student_no に変換する
-    student_no_by_team = {t: [students[m].student_no + 1 for m in members] for t, members in teams.items()}
+    num_teams = len(teams)
+    num_categories = len(MI_CATEGORIES)
+    team_of = team_of_students(teams, len(table))
+
+    # one-hot の割り当て行列 (n×T) と生徒毎の特徴量 [MI (8列) | 男性 | 女性 | リーダー] の
+    # 1回の行列積でチーム毎の合計を求める (値は小さい整数なので float64 でも誤差は出ない)
+    A = np.zeros((len(table), num_teams))
+    A[np.arange(len(table)), team_of] = 1.0
+    features = np.hstack([
+        table.mi,
+        (table.sex == 0)[:, None],
+        (table.sex == 1)[:, None],
+        (table.leader == 8)[:, None],
+    ]).astype(np.float64)
+    by_team = np.rint(A.T @ features).astype(np.int64)
+
+    mi_score = by_team[:, :num_categories]
+    mi_total = mi_score.sum(axis=1)
+    mi_spread = mi_score.max(axis=1) - mi_score.min(axis=1)
+    male, female, leader = by_team[:, num_categories:].T
+
+    # 前回も同じチームだったペアの数 ((チーム, 前回のチーム) 毎の人数から数える)
+    valid = table.previous >= 0
+    previous_codes, previous_index = np.unique(table.previous[valid], return_inverse=True)
+    counts = np.bincount(
+        team_of[valid] * len(previous_codes) + previous_index,
+        minlength=num_teams * len(previous_codes),
+    ).reshape(num_teams, len(previous_codes))
+    previous_pairs = (counts * (counts - 1) // 2).sum(axis=1)
+
+    # 同じチームに入ってしまった嫌いな生徒の組 (嫌っている側のチームで数える)
+    rows, cols = table.dislike_pairs()
+    violated = rows[team_of[rows] == team_of[cols]]
+    dislikes = np.bincount(team_of[violated], minlength=num_teams)
+
+    team_ids = list(range(num_teams))
+    return {
+        "mi_score_by_team": dict(zip(team_ids, mi_score.tolist())),
+        "mi_total_by_team": dict(zip(team_ids, mi_total.tolist())),
+        "mi_spread_by_team": dict(zip(team_ids, mi_spread.tolist())),
+        "mi_total_spread": int(mi_total.max() - mi_total.min()) if num_teams else 0,
+        "sex_by_team": {t: {"male": m, "female": f} for t, m, f in zip(team_ids, male.tolist(), female.tolist())},
+        "leader_by_team": dict(zip(team_ids, leader.tolist())),
+        "previous_by_team": dict(zip(team_ids, previous_pairs.tolist())),
+        "dislikes_by_team": dict(zip(team_ids, dislikes.tolist())),
+    }
+
+
+def calc_student_no_by_team(table: StudentTable, teams):
+    if teams is None:
+        return None
 
-    # チームのメンバーをソートする
-    student_no_by_team = {t: sorted(members) for t, members in student_no_by_team.items()}
-    return student_no_by_team
+    # student_no に変換し、チームのメンバーをソートする
+    return {
+        t: sorted((table.student_no[np.asarray(members, dtype=np.int64)] + 1).tolist())
+        for t, members in teams.items()
+    }
+
+
+def record_solve(status: LpStatusType, seconds: float, progress: SolverProgress):
+    SOLVE_SECONDS.observe(seconds, backend="cbc", status=status.name)
+    if progress.nodes is not None:
+        SOLVE_NODES.observe(progress.nodes, backend="cbc", status=status.name)
+    if progress.gap is not None:
+        SOLVE_GAP.observe(progress.gap, backend="cbc", status=status.name)
+
+
+def cbc_solver(options: SolverOptions, log_path: str):
+    """
+    SolverOptions を PULP_CBC_CMD の引数にする
+    """
+    from pulp import PULP_CBC_CMD
+
+    seed = options.seed
+    threads = options.threads
+    max_nodes = None
+    if options.deterministic:
+        # 経過時間で打ち切ると、打ち切った時点の解が実行毎に変わる
+        max_nodes = SOLVER_DETERMINISTIC_MAX_NODES
+        if seed is None:
+            seed = 0
+        if threads is not None and threads > 1:
+            # CBC の threads は 100 + n で、n スレッドの再現可能な並列探索になる
+            threads += 100
+
+    cbc_options = []
+    if seed is not None:
+        # CBC は 0 を「時刻から種を作る」の意味で使うため、1 以上にずらす
+        cbc_seed = seed % (2 ** 31 - 1) + 1
+        cbc_options += [f"randomSeed {cbc_seed}", f"randomCbcSeed {cbc_seed}"]
+
+    return PULP_CBC_CMD(
+        msg=False,
+        timeLimit=SOLVER_TIME_LIMIT,
+        logPath=log_path,
+        threads=threads,
+        maxNodes=max_nodes,
+        options=cbc_options,
+    )
 
 
 def matching(
-    student_constraints: list[StudentConstraint],
+    table: StudentTable,
     constraint: Constraint,
+    forbidden_pairs: np.ndarray | None = None,
+    timings: Timings | None = None,
+    options: SolverOptions | None = None,
 ):
+    """
+    timings を渡すと、モデルの構築 (制約の種類毎)・求解・結果の取り出しの時間を "matching.*" に記録する
+    options で CBC の乱数の種・スレッド数・再現可能なモードを指定する
+    """
+    timings = timings or Timings()
+    options = options or SolverOptions()
+
     try:
-        # 最適化問題の定義
-        prob = LpProblem("TeamMatching", LpMaximize)
-
-        # 変数の定義（各生徒が各チームに所属するかどうか）
-        x = {
-            (i, t): LpVariable(f"x_{i}_{t}", cat=LpBinary)
-            for i in range(len(student_constraints))
-            for t in range(constraint.max_num_teams)
-        }
-
-        # チーム毎のスコアの上限・下限を表す変数
-        categories = ["mi_a", "mi_b", "mi_c", "mi_d", "mi_e", "mi_f", "mi_g", "mi_h"]
-        MAX_SCORE = max(max(getattr(s, cat) for cat in categories) for s in student_constraints)
-        MIN_SCORE = min(min(getattr(s, cat) for cat in categories) for s in student_constraints)
-
-        # y[0,j]とy[1,j]: チームjの各スキルに関する下限・上限
-        y = {
-            (i, j): LpVariable(
-                f"y_{i}_{j}",
-                lowBound=MIN_SCORE * constraint.members_per_team,
-                upBound=MAX_SCORE * constraint.members_per_team,
-                cat=LpInteger,
-            )
-            for i in [0, 1]
-            for j in range(constraint.max_num_teams)
-        }
-
-        # z[0]とz[1]: 全チームの総スコアの下限・上限
-        z = {
-            i: LpVariable(
-                f"z_{i}",
-                lowBound=MIN_SCORE * constraint.members_per_team * constraint.max_num_teams,
-                upBound=MAX_SCORE * constraint.members_per_team * constraint.max_num_teams,
-                cat=LpInteger,
-            )
-            for i in [0, 1]
-        }
+        # PuLP は CBC の探索も含めて import が重いため、最初に解くとき (lifespan のウォームアップ) まで遅らせる
+        with timings.span("matching.import"):
+            from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpBinary, LpInteger
+
+        num_students = len(table)
+        num_teams = constraint.max_num_teams
+
+        with timings.span("matching.build.variables"):
+            # 最適化問題の定義
+            prob = LpProblem("TeamMatching", LpMaximize)
+
+            # 変数の定義（各生徒が各チームに所属するかどうか）
+            x = {
+                (i, t): LpVariable(f"x_{i}_{t}", cat=LpBinary)
+                for i in range(num_students)
+                for t in range(num_teams)
+            }
+
+            # チーム毎のスコアの上限・下限を表す変数
+            MAX_SCORE = int(table.mi.max())
+            MIN_SCORE = int(table.mi.min())
+
+            # y[0,j]とy[1,j]: チームjの各スキルに関する下限・上限
+            y = {
+                (i, j): LpVariable(
+                    f"y_{i}_{j}",
+                    lowBound=MIN_SCORE * constraint.members_per_team,
+                    upBound=MAX_SCORE * constraint.members_per_team,
+                    cat=LpInteger,
+                )
+                for i in [0, 1]
+                for j in range(num_teams)
+            }
+
+            # z[0]とz[1]: 全チームの総スコアの下限・上限
+            z = {
+                i: LpVariable(
+                    f"z_{i}",
+                    lowBound=MIN_SCORE * constraint.members_per_team * num_teams,
+                    upBound=MAX_SCORE * constraint.members_per_team * num_teams,
+                    cat=LpInteger,
+                )
+                for i in [0, 1]
+            }
+
+        boys = np.flatnonzero(table.sex == 0)
+        girls = np.flatnonzero(table.sex == 1)
+        leaders = np.flatnonzero(table.leader == 8)
 
         # 制約1：各生徒は1つのチームにのみ所属
-        for i in range(len(student_constraints)):
-            prob += lpSum(x[(i, t)] for t in range(constraint.max_num_teams)) == 1
+        with timings.span("matching.build.assignment"):
+            for i in range(num_students):
+                prob += lpSum(x[(i, t)] for t in range(num_teams)) == 1
 
         # 制約2：各チームの人数制限
-        for t in range(constraint.max_num_teams):
-            team_size = lpSum(x[(i, t)] for i in range(len(student_constraints)))
-            if constraint.members_per_team:
-                prob += team_size <= constraint.members_per_team
-                prob += team_size >= constraint.members_per_team - 1
-
-        # 制約3：各チームに少なくとも1人の男女がいる制約
-        if constraint.at_least_one_pair_sex:
-            for t in range(constraint.max_num_teams):
-                # 少なくとも1人の男性
-                prob += lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 0
-                ) >= 1
-                # 少なくとも1人の女性
-                prob += lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 1
-                ) >= 1
-
-        # 制約4：女性の数が男性の数以上である制約
-        if constraint.girl_geq_boy:
-            for t in range(constraint.max_num_teams):
-                prob += lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 1
-                ) >= lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 0
-                )
-
-        # 制約5：男性の数が女性の数以上である制約
-        if constraint.boy_geq_girl:
-            for t in range(constraint.max_num_teams):
-                prob += lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 0
-                ) >= lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].sex == 1
-                )
+        with timings.span("matching.build.team_size"):
+            for t in range(num_teams):
+                team_size = lpSum(x[(i, t)] for i in range(num_students))
+                if constraint.members_per_team:
+                    prob += team_size <= constraint.members_per_team
+                    prob += team_size >= constraint.members_per_team - 1
+
+        with timings.span("matching.build.sex"):
+            # 制約3：各チームに少なくとも1人の男女がいる制約
+            if constraint.at_least_one_pair_sex:
+                for t in range(num_teams):
+                    # 少なくとも1人の男性
+                    prob += lpSum(x[(i, t)] for i in boys) >= 1
+                    # 少なくとも1人の女性
+                    prob += lpSum(x[(i, t)] for i in girls) >= 1
+
+            # 制約4：女性の数が男性の数以上である制約
+            if constraint.girl_geq_boy:
+                for t in range(num_teams):
+                    prob += lpSum(x[(i, t)] for i in girls) >= lpSum(x[(i, t)] for i in boys)
+
+            # 制約5：男性の数が女性の数以上である制約
+            if constraint.boy_geq_girl:
+                for t in range(num_teams):
+                    prob += lpSum(x[(i, t)] for i in boys) >= lpSum(x[(i, t)] for i in girls)
 
         # 制約6：各チームに少なくとも1人のリーダーがいる制約
-        if constraint.at_least_one_leader:
-            for t in range(constraint.max_num_teams):
-                prob += lpSum(
-                    x[(i, t)]
-                    for i in range(len(student_constraints))
-                    if student_constraints[i].leader == 8
-                ) >= 1
-
-        # 制約7：前回と同じチームにならない制約（緩和：2人まで許可）
-        if constraint.unique_previous is not None:
-            for t in range(constraint.max_num_teams):
-                for prev_team in range(constraint.max_num_teams):
-                    prob += lpSum(
-                        x[(i, t)]
-                        for i in range(len(student_constraints))
-                        if student_constraints[i].previous == prev_team
-                    ) <= constraint.unique_previous
+        with timings.span("matching.build.leader"):
+            if constraint.at_least_one_leader:
+                for t in range(num_teams):
+                    prob += lpSum(x[(i, t)] for i in leaders) >= 1
+
+        # 制約7：前回と同じチームにならない制約（緩和：unique_previous 人まで許可）
+        # 空のグループや人数が上限以下のグループは制約が自明なので行を作らない
+        with timings.span("matching.build.previous"):
+            adjacency = table.dislike_adjacency()
+            if forbidden_pairs is not None:
+                # 複数回分の計画などで追加された「同じチームに入れない」組
+                adjacency |= forbidden_pairs
+            if constraint.unique_previous == 1:
+                # 上限が1人なら「同じチームに入れない」関係なので、制約8のグラフにまとめる
+                adjacency |= previous_adjacency(table.previous)
+            elif constraint.unique_previous is not None:
+                for members in previous_groups(table.previous, constraint.unique_previous):
+                    for t in range(num_teams):
+                        prob += lpSum(x[(i, t)] for i in members) <= constraint.unique_previous
 
         # 制約8：嫌いな生徒との割り当てを避ける
-        for i in range(len(student_constraints)):
-            for disliked in student_constraints[i].dislikes:
-                if disliked < len(student_constraints):  # 有効な名簿番号かチェック
-                    for t in range(constraint.max_num_teams):
-                        prob += x[(i, t)] + x[(disliked, t)] <= 1
+        # ペア毎ではなく、グラフのクリーク毎に1チーム1行の制約にまとめる
+        with timings.span("matching.build.dislikes"):
+            for clique in clique_cover(adjacency):
+                for t in range(num_teams):
+                    prob += lpSum(x[(i, t)] for i in clique) <= 1
 
         # チーム毎の総スコアに関する制約
-        for t in range(constraint.max_num_teams):
-            # 各スキルごとのスコア
-            for s in range(len(categories)):
-                team_skill = lpSum(
-                    x[(i, t)] * getattr(student_constraints[i], categories[s])
-                    for i in range(len(student_constraints))
-                )
-                prob += team_skill >= y[(0, t)]
-                prob += team_skill <= y[(1, t)]
-
-            # チーム全体のスコア
-            team_total = lpSum(
-                x[(i, t)] * sum(getattr(student_constraints[i], cat) for cat in categories)
-                for i in range(len(student_constraints))
+        with timings.span("matching.build.scores"):
+            mi = table.mi.astype(np.int64)
+            mi_total = mi.sum(axis=1)
+            for t in range(num_teams):
+                # 各スキルごとのスコア
+                for s in range(len(MI_CATEGORIES)):
+                    team_skill = lpSum(x[(i, t)] * int(mi[i, s]) for i in range(num_students))
+                    prob += team_skill >= y[(0, t)]
+                    prob += team_skill <= y[(1, t)]
+
+                # チーム全体のスコア
+                team_total = lpSum(x[(i, t)] * int(mi_total[i]) for i in range(num_students))
+                prob += team_total >= z[0]
+                prob += team_total <= z[1]
+
+            # 目的関数：チーム間のスコアの差を最小化
+            objective = (
+                lpSum(y[(1, t)] - y[(0, t)] for t in range(num_teams))
+                + constraint.group_diff_coeff * (z[1] - z[0])
             )
-            prob += team_total >= z[0]
-            prob += team_total <= z[1]
-
-        # 目的関数：チーム間のスコアの差を最小化
-        objective = (
-            lpSum(y[(1, t)] - y[(0, t)] for t in range(constraint.max_num_teams))
-            + constraint.group_diff_coeff * (z[1] - z[0])
-        )
         
         # 視力が悪い学生をできるだけ一つのチームにまとめる「ソフト制約」
-        # 1. eyesight が 3 または 8 の学生を対象とする
-        group_indices = [
-            i for i, s in enumerate(student_constraints) if s.eyesight in {3, 8}
-        ]
-
-        # 2. 対象学生の各ペア (i,j) について、チーム番号の差を表す補助変数 d[(i,j)] を導入
-        d = {}
-        for idx1 in range(len(group_indices)):
-            for idx2 in range(idx1 + 1, len(group_indices)):
-                i = group_indices[idx1]
-                j = group_indices[idx2]
-                # d[(i,j)] は非負の整数変数
-                d[(i, j)] = LpVariable(f"d_{i}_{j}", lowBound=0, cat=LpInteger)
-                
-                # 各生徒の所属チーム番号は、∑_{t} t * x[(i,t)] で表現される
-                # 以下の2制約で |team_i - team_j| <= d[(i,j)] を実現
-                prob += lpSum(t * x[(i, t)] for t in range(constraint.max_num_teams)) - lpSum(t * x[(j, t)] for t in range(constraint.max_num_teams)) <= d[(i, j)]
-                prob += lpSum(t * x[(j, t)] for t in range(constraint.max_num_teams)) - lpSum(t * x[(i, t)] for t in range(constraint.max_num_teams)) <= d[(i, j)]
-
-        # 3. 目的関数にペナルティ項を追加
-        # もともとの目的（チーム間のスコア差などを最小化する項）が定義されていると仮定して、その上に加えます。
-        # ここで、各ペアのペナルティは (eyesight_i + eyesight_j) 倍となります。
-        objective += - lpSum((student_constraints[i].eyesight + student_constraints[j].eyesight) * d[(i, j)] for (i, j) in d)
-        
-        # 解を探す
-        prob += objective
-
-        # 最適化問題を解く
-        solver = PULP_CBC_CMD(msg=True, timeLimit=60)
-        status = prob.solve(solver)
+        with timings.span("matching.build.eyesight"):
+            # 1. eyesight が 3 または 8 の学生を対象とする
+            group_indices = np.flatnonzero(np.isin(table.eyesight, [3, 8])).tolist()
+
+            # 2. 対象学生の各ペア (i,j) について、チーム番号の差を表す補助変数 d[(i,j)] を導入
+            d = {}
+            for idx1 in range(len(group_indices)):
+                for idx2 in range(idx1 + 1, len(group_indices)):
+                    i = group_indices[idx1]
+                    j = group_indices[idx2]
+                    # d[(i,j)] は非負の整数変数
+                    d[(i, j)] = LpVariable(f"d_{i}_{j}", lowBound=0, cat=LpInteger)
+                    
+                    # 各生徒の所属チーム番号は、∑_{t} t * x[(i,t)] で表現される
+                    # 以下の2制約で |team_i - team_j| <= d[(i,j)] を実現
+                    prob += lpSum(t * x[(i, t)] for t in range(num_teams)) - lpSum(t * x[(j, t)] for t in range(num_teams)) <= d[(i, j)]
+                    prob += lpSum(t * x[(j, t)] for t in range(num_teams)) - lpSum(t * x[(i, t)] for t in range(num_teams)) <= d[(i, j)]
+
+            # 3. 目的関数にペナルティ項を追加
+            # もともとの目的（チーム間のスコア差などを最小化する項）が定義されていると仮定して、その上に加えます。
+            # ここで、各ペアのペナルティは (eyesight_i + eyesight_j) 倍となります。
+            objective += - lpSum(int(table.eyesight[i] + table.eyesight[j]) * d[(i, j)] for (i, j) in d)
+            
+            # 解を探す
+            prob += objective
+
+        MODEL_VARIABLES.set(prob.numVariables())
+        MODEL_CONSTRAINTS.set(prob.numConstraints())
+
+        # 最適化問題を解く (MPS の書き出し・CBC の実行・解の読み込み)
+        # CBC の出力は標準出力に流さず、一時ファイルに書き出させてから解析する
+        with timings.span("matching.solve"), capture_log() as solver_log:
+            solve_start = time.perf_counter()
+            status = prob.solve(cbc_solver(options, solver_log.path))
         lp_status_type = LpStatusType(status)
+        solve_seconds = time.perf_counter() - solve_start
 
         # 結果の取得とログ出力
-        logger.info(f"Optimization status: {status}")
-        logger.info(f"Objective value: {prob.objective.value()}")
+        progress = parse_cbc_log(solver_log.text, maximize=True)
+        record_solve(lp_status_type, solve_seconds, progress)
+        logger.info(json.dumps({
+            "event": "solve",
+            "backend": "cbc",
+            "status": lp_status_type.name,
+            "students": num_students,
+            "teams": num_teams,
+            "variables": prob.numVariables(),
+            "constraints": prob.numConstraints(),
+            **options.model_dump(),
+            **progress.as_dict(),
+        }))
+        if options.deterministic and progress.result == "Stopped on time limit":
+            logger.warning(
+                f"Solve stopped on the {SOLVER_TIME_LIMIT}s time limit before the node limit; "
+                "the result may differ between runs"
+            )
+        # 解が得られなかった場合は要約だけを残し、CBC のログそのものは DEBUG の場合だけ残す
+        # (sweep では実行不可能な候補がよくあるため、候補毎に長いログを出さない)
+        if lp_status_type not in (LpStatusType.OPTIMAL, LpStatusType.FEASIBLE):
+            logger.warning(
+                f"Solve ended with {lp_status_type.name}: result={progress.result} "
+                f"nodes={progress.nodes} gap={progress.gap} seconds={solve_seconds:.2f}"
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Solver log ({lp_status_type.name}):\n{solver_log.text}")
 
-        teams = {t: [] for t in range(constraint.max_num_teams)}
         match lp_status_type:
             case LpStatusType.OPTIMAL | LpStatusType.FEASIBLE:  # 最適解が見つかった場合
-                for i in range(len(student_constraints)):
-                    for t in range(constraint.max_num_teams):
-                        if x[(i, t)].value() > 0.5:  # バイナリ変数なので0.5以上を1とみなす
-                            teams[t].append(i)
+                with timings.span("matching.extract"):
+                    values = np.array(
+                        [[x[(i, t)].value() or 0.0 for t in range(num_teams)] for i in range(num_students)]
+                    ).reshape(num_students, num_teams)
+                    # バイナリ変数なので最大の値を持つチームを所属チームとみなす
+                    assignment = values.argmax(axis=1)
+                    teams = {t: np.flatnonzero(assignment == t).tolist() for t in range(num_teams)}
                 return teams, lp_status_type, ""
             case LpStatusType.NOT_SOLVED:
                 logger.error("No Solution Found")
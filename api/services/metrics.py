@@ -0,0 +1,240 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable
+
+# Prometheus のテキスト形式 (version 0.0.4)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    ワーカー (プロセス) 毎のメトリクス
+    ソルバーのプールの子プロセスで記録した値は、このプロセスの /metrics には含まれない
+    callback を渡すと、記録する代わりに /metrics を読むときに {ラベルの値のタプル: 値} を求める
+    """
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        callback: Callable[[], dict] | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self.values: dict[tuple, object] = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels[n] for n in self.labelnames)
+
+    def current(self) -> list[tuple[tuple, float]]:
+        if self.callback is not None:
+            return list(self.callback().items())
+        with self.lock:
+            return list(self.values.items())
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in self.current()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # [バケット毎の件数..., 合計]
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(k, list(v)) for k, v in self.values.items()]
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+# API
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status"),
+)
+
+# ソルバー
+
+SOLVE_SECONDS = Histogram(
+    "solver_solve_duration_seconds",
+    "Solver wall time (write model, run solver, read solution) by backend and status",
+    ("backend", "status"),
+)
+SOLVE_NODES = Histogram(
+    "solver_nodes",
+    "Branch-and-bound nodes enumerated per solve (from the solver log)",
+    ("backend", "status"),
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+SOLVE_GAP = Histogram(
+    "solver_gap",
+    "Relative gap between the best solution and the bound when the solver stopped",
+    ("backend", "status"),
+    buckets=(0, 0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+MODEL_VARIABLES = Gauge("solver_model_variables", "Number of variables in the last model built")
+MODEL_CONSTRAINTS = Gauge("solver_model_constraints", "Number of constraints in the last model built")
+
+# LLM
+
+LLM_SECONDS = Histogram(
+    "llm_request_duration_seconds",
+    "LLM call latency per attempt by backend and outcome",
+    ("backend", "outcome"),
+)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used", ("model", "kind"))
+
+
+# /metrics を読むときに求める値 (循環 import を避けるため、呼び出し時に import する)
+
+def _pool_stats():
+    from services.pool import pool_stats
+
+    return pool_stats()
+
+
+def _cache_stats():
+    from services.spec_cache import spec_cache
+    from services.surveys import survey_cache
+
+    return {"spec": spec_cache.stats(), "survey": survey_cache.stats()}
+
+
+POOL_WORKERS = Gauge(
+    "solver_pool_workers", "Solver pool size",
+    callback=lambda: {(): _pool_stats()["workers"]},
+)
+POOL_BUSY = Gauge(
+    "solver_pool_busy_workers", "Solver pool workers running a task",
+    callback=lambda: {(): _pool_stats()["busy"]},
+)
+POOL_QUEUED = Gauge(
+    "solver_pool_queued_tasks", "Tasks waiting for a solver pool worker",
+    callback=lambda: {(): _pool_stats()["queued"]},
+)
+CACHE_HITS = Counter(
+    "cache_hits_total", "Cache hits", ("cache",),
+    callback=lambda: {(name,): s["hits"] for name, s in _cache_stats().items()},
+)
+CACHE_MISSES = Counter(
+    "cache_misses_total", "Cache misses", ("cache",),
+    callback=lambda: {(name,): s["misses"] for name, s in _cache_stats().items()},
+)
+CACHE_HIT_RATIO = Gauge(
+    "cache_hit_ratio", "Cache hits / lookups since the worker started", ("cache",),
+    callback=lambda: {(name,): s["hit_ratio"] for name, s in _cache_stats().items()},
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    ルート (パスのテンプレート) 毎のレイテンシを記録する ASGI ミドルウェア
+    どのルートにも一致しないリクエストは route="unmatched" にまとめる (ラベルの種類を増やさない)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
@@ -0,0 +1,63 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+
+logger = logging.getLogger(__name__)
+
+# bcrypt を計算するスレッド数 (bcrypt は計算中に GIL を解放する)
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "4"))
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    bcrypt 専用のスレッドプール
+    ログインが集中しても同時に計算するのは BCRYPT_WORKERS 件までで、残りはプールの中で待つ
+    (イベントループや run_in_threadpool の既定のスレッドは塞がない)
+    """
+    global _executor
+    if _executor is None:
+        logger.info(f"Starting bcrypt pool with {BCRYPT_WORKERS} workers")
+        _executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+@cache
+def pwd_context():
+    """
+    passlib の import と bcrypt のバックエンドの読み込みは、最初にログインしたときまで遅らせる
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _verify(password: str, hashed: str) -> bool:
+    try:
+        # 定数時間で比較する
+        return pwd_context().verify(password, hashed)
+    except (ValueError, TypeError):
+        # 保存されているハッシュが bcrypt の形式ではない
+        return False
+
+
+async def verify_password(password: str, hashed: str | None) -> bool:
+    if not hashed:
+        return False
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _verify, password, hashed)
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), pwd_context().hash, password)
@@ -0,0 +1,77 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ソルバーのプールのワーカープロセス数 (uvicorn のワーカー毎)
+# uvicorn を複数ワーカーで動かすとその数だけプールができるため、既定値は CPU 数に関わらず 4 までにする
+SOLVER_WORKERS = int(os.getenv("SOLVER_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+class SolverPool(ProcessPoolExecutor):
+    """
+    実行中と待ち中のタスクの数を数える ProcessPoolExecutor (/metrics 用)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        with self.pending_lock:
+            self.pending += 1
+        # 完了・取り消しのどちらでも呼ばれる
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.pending_lock:
+            self.pending -= 1
+
+
+_executor: SolverPool | None = None
+
+
+def get_executor() -> SolverPool:
+    """
+    ソルバー用のワーカープロセスのプール (プロセス毎に1つ、初回利用時 (/match/sweep) に作る)
+    uvicorn のスレッドを抱えたまま fork しないように spawn で起動する
+    各ワーカーは起動時に小さな問題を1回解く (services.warmup)
+    """
+    global _executor
+    if _executor is None:
+        from services.warmup import warm_worker
+
+        logger.info(f"Starting solver pool with {SOLVER_WORKERS} workers")
+        _executor = SolverPool(
+            max_workers=SOLVER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_worker,
+        )
+    return _executor
+
+
+def pool_stats() -> dict:
+    """
+    ワーカー数と、タスクを実行中のワーカー数・空きを待っているタスク数
+    """
+    if _executor is None:
+        return {"workers": 0, "busy": 0, "queued": 0}
+    pending = _executor.pending
+    return {
+        "workers": SOLVER_WORKERS,
+        "busy": min(pending, SOLVER_WORKERS),
+        "queued": max(pending - SOLVER_WORKERS, 0),
+    }
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,59 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from models.match import Constraint
+from routers.graphql import execute
+from routers.documents import INSERT_MATCHING_RESULT
+from services.surveys import SurveySnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def matching_result_name(snapshot: SurveySnapshot) -> str:
+    """
+    フロントエンドと同じ「クラス名_日時」(日時は UTC の ISO 8601)
+    """
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return f"{snapshot.class_name}_{timestamp}"
+
+
+def matching_result_object(snapshot: SurveySnapshot, constraint: Constraint, teams, name: str) -> dict:
+    """
+    matching_results の1行と、その teams の全ての行 (入れ子の insert の object)
+    """
+    return {
+        "survey_id": snapshot.survey_id,
+        "name": name,
+        "status": 0,
+        "constraints_json": json.loads(constraint.model_dump_json()),
+        "teams": {
+            "data": [
+                {
+                    "team_id": int(t),
+                    "name": f"Team {t}",
+                    "student_preference_id": int(snapshot.preference_ids[i]),
+                }
+                for t, members in teams.items()
+                for i in members
+            ]
+        },
+    }
+
+
+async def save_matching_result(snapshot: SurveySnapshot, constraint: Constraint, teams, name: str):
+    """
+    レスポンスを返した後に BackgroundTasks で実行する
+    失敗してもレスポンスには影響しないため、ログに残すだけにする
+    """
+    try:
+        result = await execute(
+            INSERT_MATCHING_RESULT,
+            variable_values={"object": matching_result_object(snapshot, constraint, teams, name)},
+        )
+        logger.info(
+            f"Saved matching result {result['insert_matching_results_one']['id']} "
+            f"({sum(len(m) for m in teams.values())} team rows)"
+        )
+    except Exception as e:
+        logger.error(f"Error saving matching result for survey {snapshot.survey_id}: {str(e)}")
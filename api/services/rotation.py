@@ -0,0 +1,58 @@
+import logging
+from dataclasses import replace
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from models.match import Constraint, SolverOptions
+from models.table import StudentTable
+from services.match import matching, team_of_students
+
+logger = logging.getLogger(__name__)
+
+
+def pair_meetings(team_of: np.ndarray) -> np.ndarray:
+    """
+    同じチームになった生徒の組を 1 とする行列 (int64, n×n, 対角は 0)
+    チームが無い生徒 (負の値) は誰とも同じチームにならない
+    """
+    same = (team_of[:, None] == team_of[None, :]) & (team_of[:, None] >= 0)
+    np.fill_diagonal(same, False)
+    return same.astype(np.int64)
+
+
+async def plan_rotation(
+    table: StudentTable,
+    constraint: Constraint,
+    rounds: int,
+    max_pair_meetings: int,
+    options: SolverOptions | None = None,
+):
+    """
+    今後 rounds 回分の班替えをまとめて計画する
+
+    1つの巨大なモデルにはせず、1回分ずつ解くローリングホライズン法で進める
+    各回はそれまでの回 (と前回のチーム) で同じチームになった回数が max_pair_meetings に
+    達した組を「同じチームに入れない」組として matching() に渡し、前回のチームを直前の回に
+    置き換えて解く。各回の MI のバランスは matching() の目的関数がそのまま保つ
+    ソルバーはスレッドプールで実行し、イベントループを止めない
+
+    :return: (各回の (その回の StudentTable, チーム), 各回のステータス, エラーメッセージ)
+    """
+    meetings = pair_meetings(table.previous)
+    plans = []
+    statuses = []
+    for r in range(rounds):
+        forbidden = meetings >= max_pair_meetings
+        teams, status, error = await run_in_threadpool(matching, table, constraint, forbidden, options=options)
+        statuses.append(status)
+        if teams is None:
+            logger.error(f"Rotation round {r} failed: {error}")
+            return plans, statuses, f"Round {r}: {error}"
+        plans.append((table, teams))
+
+        team_of = team_of_students(teams, len(table))
+        meetings += pair_meetings(team_of)
+        table = replace(table, previous=team_of)
+
+    return plans, statuses, ""
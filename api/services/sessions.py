@@ -0,0 +1,79 @@
+import os
+import logging
+from typing import Optional
+
+from fastapi import Header, HTTPException, status
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# 全てのワーカーで同じ値にする
+# 未設定の場合はトークンを発行せず、受け取ったトークンも検証しない (ワーカー毎の秘密鍵では他のワーカーが発行したトークンを検証できない)
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+# トークンの有効期限 (秒)
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(12 * 60 * 60)))
+# True の場合、/match と /llm はトークンが無いリクエストを拒否する
+REQUIRE_SESSION = os.getenv("REQUIRE_SESSION") == "True"
+
+if SESSION_SECRET is None:
+    if REQUIRE_SESSION:
+        raise RuntimeError("REQUIRE_SESSION is True but SESSION_SECRET is not set")
+    logger.warning("SESSION_SECRET is not set, session tokens are disabled")
+    _serializer = None
+else:
+    _serializer = URLSafeTimedSerializer(SESSION_SECRET, salt="session")
+
+
+class Session(BaseModel):
+    user_id: int
+    email: str
+
+
+def issue_token(user_id: int, email: str) -> str | None:
+    """
+    サインインした教員の署名付きトークン (SESSION_MAX_AGE 秒で失効する)
+    SESSION_SECRET が未設定の場合は None
+    """
+    if _serializer is None:
+        return None
+    return _serializer.dumps({"user_id": user_id, "email": email})
+
+
+def load_token(token: str) -> Session:
+    """
+    署名と有効期限だけを確かめる (GraphQL にも bcrypt にも問い合わせない)
+    """
+    return Session(**_serializer.loads(token, max_age=SESSION_MAX_AGE))
+
+
+async def current_session(authorization: Optional[str] = Header(None)) -> Optional[Session]:
+    """
+    Authorization: Bearer <token> を検証する依存関数
+    トークンが無い場合は REQUIRE_SESSION の時だけ拒否し、不正・期限切れのトークンは常に拒否する
+    SESSION_SECRET が未設定の場合はトークンを検証せず None を返す
+    """
+    if _serializer is None:
+        return None
+    if not authorization:
+        if REQUIRE_SESSION:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="No session token"
+            )
+        return None
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authorization header"
+        )
+    try:
+        return load_token(token)
+    except SignatureExpired:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired"
+        )
+    except BadSignature:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid session token"
+        )
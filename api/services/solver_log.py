@@ -0,0 +1,119 @@
+import os
+import re
+import logging
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+
+logger = logging.getLogger(__name__)
+
+# CBC のログの行 (https://github.com/coin-or/Cbc の CbcMessage.cpp)
+# -max で解く場合、CBC は符号を反転して最小化するため、Cbc で始まる行の値も反転している
+INCUMBENT = re.compile(r"^Cbc00(?:04|12)I Integer solution of (\S+) found .*\(([\d.]+) seconds\)")
+NODE_LOG = re.compile(r"^Cbc0010I After (\d+) nodes, \d+ on tree, (\S+) best solution, best possible (\S+) \(([\d.]+) seconds\)")
+PARTIAL = re.compile(r"^Cbc0005I Partial search - best objective (\S+) \(best possible (\S+)\), took \d+ iterations and (\d+) nodes")
+RESULT = re.compile(r"^Result - (.+)$")
+# 前処理で解が無いと分かった場合は Result の行が無い
+PRESOLVE = re.compile(r"^(Problem is (?:infeasible|unbounded)) - [\d.]+ seconds")
+TOTAL_TIME = re.compile(r"^Total time \(CPU seconds\):\s+\S+\s+\(Wallclock seconds\):\s+(\S+)")
+SUMMARY = re.compile(r"^(Objective value|Lower bound|Upper bound|Enumerated nodes|Total iterations|Time \(Wallclock seconds\)):\s+(\S+)")
+
+# CBC が解が無いことを表す値
+NO_SOLUTION = 1e50
+
+
+@dataclass
+class SolverProgress:
+    """
+    CBC のログから読み取った求解の経過 (目的関数値はモデルの向き)
+    """
+    result: str | None = None  # "Optimal solution found" / "Stopped on time limit" など
+    objective: float | None = None
+    bound: float | None = None  # 目的関数値の上限 (最大化)
+    gap: float | None = None  # |bound - objective| / |objective|
+    nodes: int | None = None
+    iterations: int | None = None
+    seconds: float | None = None
+    incumbents: list[tuple[float, float]] = field(default_factory=list)  # (秒, 目的関数値)
+    bounds: list[tuple[float, float]] = field(default_factory=list)  # (秒, 上限)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _value(text: str, sign: int) -> float | None:
+    value = float(text)
+    return None if abs(value) >= NO_SOLUTION else sign * value
+
+
+def parse_cbc_log(text: str, maximize: bool = True) -> SolverProgress:
+    sign = -1 if maximize else 1
+    progress = SolverProgress()
+    for line in text.splitlines():
+        line = line.strip()
+        if m := INCUMBENT.match(line):
+            progress.incumbents.append((float(m[2]), _value(m[1], sign)))
+        elif m := NODE_LOG.match(line):
+            progress.bounds.append((float(m[4]), _value(m[3], sign)))
+            progress.nodes = int(m[1])
+        elif m := PARTIAL.match(line):
+            progress.bound = _value(m[2], sign)
+            progress.nodes = int(m[3])
+        elif m := RESULT.match(line) or PRESOLVE.match(line):
+            progress.result = m[1]
+        elif m := TOTAL_TIME.match(line):
+            progress.seconds = float(m[1])
+        elif m := SUMMARY.match(line):
+            key, value = m[1], m[2]
+            if key == "Objective value":
+                progress.objective = float(value)
+            elif key in ("Lower bound", "Upper bound"):
+                progress.bound = float(value)
+            elif key == "Enumerated nodes":
+                progress.nodes = int(value)
+            elif key == "Total iterations":
+                progress.iterations = int(value)
+            else:
+                progress.seconds = float(value)
+
+    if progress.bound is None and progress.result == "Optimal solution found":
+        progress.bound = progress.objective
+    if progress.objective is not None and progress.bound is not None:
+        progress.gap = abs(progress.bound - progress.objective) / max(abs(progress.objective), 1e-10)
+    return progress
+
+
+class SolverLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.text = ""
+
+
+@contextmanager
+def capture_log():
+    """
+    CBC の出力を一時ファイルに書き出させ (PULP_CBC_CMD の logPath)、終わったら読み込んで消す
+    標準出力には出さない。求解中に例外が起きた場合は、ログをそのままエラーとして記録する
+    """
+    fd, path = tempfile.mkstemp(prefix="cbc-", suffix=".log")
+    os.close(fd)
+    log = SolverLog(path)
+    try:
+        yield log
+    except Exception:
+        log.text = read_log(path)
+        logger.error(f"Solver failed, log:\n{log.text}")
+        raise
+    else:
+        log.text = read_log(path)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_log(path: str) -> str:
+    try:
+        with open(path, errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
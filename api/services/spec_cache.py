@@ -0,0 +1,104 @@
+import os
+import json
+import asyncio
+import sqlite3
+import logging
+from datetime import datetime
+
+from models.ingest import MappingSpec
+from services.ingest import header_fingerprint, uncovered_values
+
+logger = logging.getLogger(__name__)
+
+# 再起動しても残すファイルの置き場所 (Docker ではボリュームを割り当てる /app/data)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+SPEC_CACHE_PATH = os.getenv("SPEC_CACHE_PATH", os.path.join(DATA_DIR, "spec_cache.sqlite3"))
+
+
+class SpecCache:
+    """
+    LLM が作った列と値の対応表を、見出しの行のハッシュをキーにして SQLite に保存する
+    見出しが同じでも、選択式の列に対応表に無い値がある場合はヒットとみなさない
+    SQLite の読み書き (ロック待ちを含む) はスレッドで行い、イベントループを止めない
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mapping_specs (
+                    fingerprint TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    spec_json TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    async def get(self, kind: str, header: list[str], rows: list[list[str]]) -> MappingSpec | None:
+        return await asyncio.to_thread(self._get, kind, header, rows)
+
+    async def put(self, kind: str, header: list[str], spec: MappingSpec):
+        await asyncio.to_thread(self._put, kind, header, spec)
+
+    def _get(self, kind: str, header: list[str], rows: list[list[str]]) -> MappingSpec | None:
+        fingerprint = header_fingerprint(kind, header)
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT spec_json FROM mapping_specs WHERE fingerprint = ?", (fingerprint,)
+                ).fetchone()
+                spec = MappingSpec(**json.loads(row[0])) if row else None
+                if spec is not None and not uncovered_values(spec, rows):
+                    conn.execute(
+                        "UPDATE mapping_specs SET hits = hits + 1 WHERE fingerprint = ?", (fingerprint,)
+                    )
+                    self.hits += 1
+                    return spec
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error(f"Error reading spec cache: {str(e)}")
+        self.misses += 1
+        return None
+
+    def _put(self, kind: str, header: list[str], spec: MappingSpec):
+        fingerprint = header_fingerprint(kind, header)
+        now = datetime.now().isoformat()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO mapping_specs (fingerprint, kind, spec_json, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (fingerprint) DO UPDATE SET
+                        spec_json = excluded.spec_json,
+                        updated_at = excluded.updated_at
+                    """,
+                    (fingerprint, kind, spec.model_dump_json(), now, now),
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error writing spec cache: {str(e)}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+spec_cache = SpecCache(SPEC_CACHE_PATH)
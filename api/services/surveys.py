@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from models.table import StudentTable, MI_CATEGORIES
+from routers.graphql import execute
+from routers.documents import GET_SURVEY_PREFERENCES, GET_SURVEY_VERSIONS
+
+logger = logging.getLogger(__name__)
+
+# 取得したアンケートをワーカー毎に保持する秒数と件数
+SURVEY_CACHE_TTL = float(os.getenv("SURVEY_CACHE_TTL", "600"))
+SURVEY_CACHE_SIZE = int(os.getenv("SURVEY_CACHE_SIZE", "64"))
+# True の場合、キャッシュを使う前に更新日時と回答数だけを問い合わせて最新か確かめる
+# Hasura のイベントトリガーは1つのワーカーにしか届かないため、複数のワーカーで動かす場合は True のままにする
+# 回答・NG指定・学生 (名簿番号・性別) の変更は、DB のトリガー (backend/sql/schema/006_touch_updated_at.sql) が
+# 回答の updated_at に反映する。このマイグレーションが無い DB では変更を検出できず、SURVEY_CACHE_TTL だけが鮮度の上限になる
+SURVEY_CACHE_CHECK = os.getenv("SURVEY_CACHE_CHECK", "True") == "True"
+
+
+@dataclass(frozen=True)
+class SurveySnapshot:
+    """
+    アンケートの回答から作った StudentTable と、行毎の student_preferences.id
+    行は名簿番号順に並べる
+    """
+    survey_id: int
+    class_name: str | None
+    updated_at: str  # アンケートと回答の updated_at の最大値
+    table: StudentTable
+    preference_ids: np.ndarray  # int64 (n,)
+    student_ids: np.ndarray  # int64 (n,)
+
+    @property
+    def version(self) -> tuple[str, int]:
+        return self.updated_at, len(self.table)
+
+
+def build_snapshot(survey: dict) -> SurveySnapshot:
+    """
+    getSurveyPreferences の結果から直接 NumPy の配列を作る
+    値の変換はフロントエンド (match_student_preferences.ts) と同じ (名簿番号・性別・前回のチームは 0-index)
+    """
+    preferences = sorted(
+        survey["student_preferences"],
+        key=lambda p: (p["student"]["student_no"], p["id"]),
+    )
+    n = len(preferences)
+    row_of_student = {p["student"]["id"]: i for i, p in enumerate(preferences)}
+
+    # 嫌いな生徒は行番号にする (アンケートに回答していない生徒と自分自身は無視する)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indices = []
+    for i, p in enumerate(preferences):
+        targets = [
+            row_of_student[d["student_id"]]
+            for d in p["student_dislikes"]
+            if d["student_id"] in row_of_student and row_of_student[d["student_id"]] != i
+        ]
+        indices += targets
+        indptr[i + 1] = indptr[i] + len(targets)
+
+    table = StudentTable(
+        student_no=np.array([p["student"]["student_no"] - 1 for p in preferences], dtype=np.int64),
+        mi=np.array(
+            [[p[cat] for cat in MI_CATEGORIES] for p in preferences], dtype=np.int8
+        ).reshape(n, len(MI_CATEGORIES)),
+        sex=np.array([p["student"]["sex"] - 1 for p in preferences], dtype=np.int8),
+        leader=np.array([p["leader"] for p in preferences], dtype=np.int8),
+        eyesight=np.array([p["eyesight"] for p in preferences], dtype=np.int8),
+        previous=np.array([p["previous_team"] - 1 for p in preferences], dtype=np.int64),
+        dislike_indptr=indptr,
+        dislike_indices=np.array(indices, dtype=np.int64),
+    )
+    return SurveySnapshot(
+        survey_id=int(survey["id"]),
+        class_name=(survey.get("class") or {}).get("name"),
+        updated_at=max([survey["updated_at"], *[p["updated_at"] for p in preferences]]),
+        table=table,
+        preference_ids=np.array([p["id"] for p in preferences], dtype=np.int64),
+        student_ids=np.array([p["student"]["id"] for p in preferences], dtype=np.int64),
+    )
+
+
+def survey_version(survey: dict) -> tuple[str, int]:
+    """
+    getSurveyVersions の結果から SurveySnapshot.version と同じ値を作る
+    NG指定と学生の変更は、DB のトリガーで回答の updated_at に含まれる
+    """
+    aggregate = survey["student_preferences_aggregate"]["aggregate"]
+    updated_at = max(survey["updated_at"], (aggregate["max"] or {}).get("updated_at") or "")
+    return updated_at, aggregate["count"]
+
+
+class SurveyCache:
+    """
+    アンケート毎の SurveySnapshot の TTL 付きキャッシュ (LRU)
+    同じアンケートで制約を変えて何度も解く場合に、回答の取得を省く
+    """
+
+    def __init__(self, ttl: float = SURVEY_CACHE_TTL, size: int = SURVEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries: OrderedDict[int, tuple[float, SurveySnapshot]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, survey_id: int) -> SurveySnapshot | None:
+        entry = self.entries.get(survey_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.entries.pop(survey_id, None)
+            return None
+        self.entries.move_to_end(survey_id)
+        return entry[1]
+
+    def put(self, snapshot: SurveySnapshot):
+        self.entries[snapshot.survey_id] = (time.monotonic(), snapshot)
+        self.entries.move_to_end(snapshot.survey_id)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, survey_id: int | None = None, preference_id: int | None = None, student_id: int | None = None) -> list[int]:
+        """
+        アンケート・回答・生徒の id から、それを含むキャッシュを消す (消したアンケートの id を返す)
+        """
+        removed = [
+            key for key, (_, snapshot) in self.entries.items()
+            if key == survey_id
+            or (preference_id is not None and preference_id in snapshot.preference_ids)
+            or (student_id is not None and student_id in snapshot.student_ids)
+        ]
+        for key in removed:
+            del self.entries[key]
+        return removed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+survey_cache = SurveyCache()
+
+
+async def fetch_versions(survey_ids: list[int]) -> dict[int, tuple[str, int]]:
+    result = await execute(GET_SURVEY_VERSIONS, variable_values={"survey_ids": survey_ids})
+    return {int(s["id"]): survey_version(s) for s in result["surveys"]}
+
+
+class SurveyLoader:
+    """
+    DataLoader と同じ方式で、同じイベントループの周回で要求されたアンケートを1回のクエリでまとめて取得する
+    取得中のアンケートを再び要求された場合は、同じ結果を待つ
+    キャッシュにあるアンケートは、最新であれば回答を取得しない
+    """
+
+    def __init__(self):
+        self.pending: dict[int, asyncio.Future] = {}
+        self.inflight: dict[int, asyncio.Future] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def load(self, survey_id: int) -> SurveySnapshot | None:
+        future = self.inflight.get(survey_id) or self.pending.get(survey_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            if not self.pending:
+                # 次の周回で実行されるため、それまでに要求されたアンケートも同じクエリで取得する
+                task = asyncio.create_task(self.dispatch())
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self.pending[survey_id] = future
+        return await asyncio.shield(future)
+
+    async def dispatch(self):
+        batch, self.pending = self.pending, {}
+        self.inflight.update(batch)
+        try:
+            snapshots = {}
+            for survey_id in batch:
+                snapshot = survey_cache.get(survey_id)
+                if snapshot is not None:
+                    snapshots[survey_id] = snapshot
+            if snapshots and SURVEY_CACHE_CHECK:
+                versions = await fetch_versions(list(snapshots))
+                snapshots = {
+                    survey_id: snapshot for survey_id, snapshot in snapshots.items()
+                    if versions.get(survey_id) == snapshot.version
+                }
+            survey_cache.hits += len(snapshots)
+
+            missing = [survey_id for survey_id in batch if survey_id not in snapshots]
+            if missing:
+                survey_cache.misses += len(missing)
+                result = await execute(GET_SURVEY_PREFERENCES, variable_values={"survey_ids": missing})
+                for survey in result["surveys"]:
+                    snapshot = build_snapshot(survey)
+                    survey_cache.put(snapshot)
+                    snapshots[snapshot.survey_id] = snapshot
+                logger.info(f"Loaded {len(result['surveys'])}/{len(missing)} surveys in one query")
+
+            for survey_id, future in batch.items():
+                future.set_result(snapshots.get(survey_id))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for survey_id in batch:
+                self.inflight.pop(survey_id, None)
+
+
+survey_loader = SurveyLoader()
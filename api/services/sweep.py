@@ -0,0 +1,227 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from fractions import Fraction
+from math import ceil, floor
+
+import numpy as np
+
+from models.match import Constraint, SolverOptions
+from models.table import StudentTable
+from services.cliques import previous_adjacency, clique_cover
+from services.match import matching, calc_team_report, team_of_students, LpStatusType
+from services.pool import get_executor
+
+logger = logging.getLogger(__name__)
+
+# 1回の sweep で解く候補の数の上限 (候補毎に1回ずつ解くため)
+SWEEP_MAX_CANDIDATES = int(os.getenv("SWEEP_MAX_CANDIDATES", "32"))
+
+
+@dataclass
+class Candidate:
+    num_teams: int
+    members_per_team: int
+    state: str = "pending"  # pending | skipped | solved | failed | cancelled
+    reason: str = ""
+    score: float | None = None
+    teams: dict | None = None
+    # この構成のどの割り当てもこれより良いスコアにはならない (score_lower_bound)
+    bound: float = 0.0
+
+    @property
+    def key(self):
+        # 同じスコアの場合はチーム数、人数の少ない構成を選ぶ (終わった順に依らない)
+        return self.score, self.num_teams, self.members_per_team
+
+
+def candidate_configs(
+    num_students: int,
+    min_num_teams: int,
+    max_num_teams: int,
+    min_members_per_team: int | None,
+    max_members_per_team: int | None,
+) -> list[tuple[int, int]]:
+    """
+    チーム数と人数の組の候補
+    1チームの人数は members_per_team または members_per_team - 1 なので、
+    T × (m - 1) <= n <= T × m を満たす組だけを残す
+    """
+    configs = []
+    for num_teams in range(max(min_num_teams, 1), max_num_teams + 1):
+        low = min_members_per_team or 1
+        high = max_members_per_team or num_students
+        for members_per_team in range(max(low, 1), high + 1):
+            if num_teams * (members_per_team - 1) <= num_students <= num_teams * members_per_team:
+                configs.append((num_teams, members_per_team))
+    return configs
+
+
+def largest_conflict_clique(table: StudentTable, constraint: Constraint) -> int:
+    """
+    互いに同じチームに入れない生徒の集まり (嫌いな生徒と、unique_previous が 1 の場合の前回のチーム) の
+    最大の人数 (クリーク被覆の中で最大のクリーク)
+    チーム数と人数に依らないため、sweep では1回だけ求める
+    """
+    adjacency = table.dislike_adjacency()
+    if constraint.unique_previous == 1:
+        adjacency |= previous_adjacency(table.previous)
+    return max((len(clique) for clique in clique_cover(adjacency)), default=0)
+
+
+def infeasible_reason(table: StudentTable, constraint: Constraint, conflict_clique: int) -> str:
+    """
+    解くまでもなく実行不可能な構成を人数の数え上げだけで判定する
+    conflict_clique は largest_conflict_clique の値
+    実行不可能なら理由を、そうでなければ空文字を返す
+    """
+    num_teams = constraint.max_num_teams
+    boys = int((table.sex == 0).sum())
+    girls = int((table.sex == 1).sum())
+
+    if constraint.at_least_one_pair_sex and min(boys, girls) < num_teams:
+        return "Not enough boys or girls for every team"
+    if constraint.at_least_one_leader and int((table.leader == 8).sum()) < num_teams:
+        return "Not enough leaders for every team"
+    if constraint.girl_geq_boy and girls < boys:
+        return "Fewer girls than boys"
+    if constraint.boy_geq_girl and boys < girls:
+        return "Fewer boys than girls"
+
+    if constraint.unique_previous is not None and constraint.unique_previous != 1:
+        _, sizes = np.unique(table.previous[table.previous >= 0], return_counts=True)
+        if len(sizes) and sizes.max() > constraint.unique_previous * num_teams:
+            return "A previous team is too large to spread over the teams"
+    # 互いに同じチームに入れない生徒の集まりはチーム数より多くてはいけない
+    if conflict_clique > num_teams:
+        return "Too many mutually exclusive students for the teams"
+    return ""
+
+
+def team_score(table: StudentTable, teams) -> float:
+    """
+    1人あたりの MI 合計のチーム間の差 (小さいほど良い)
+    チーム数や人数が違う構成どうしを比べられるように人数で割る
+    """
+    report = calc_team_report(table, teams)
+    team_of = team_of_students(teams, len(table))
+    sizes = np.bincount(team_of, minlength=len(teams))
+    totals = np.array(list(report["mi_total_by_team"].values()), dtype=np.float64)
+    mean = totals / np.maximum(sizes, 1)
+    return round(float(mean.max() - mean.min()), 6)
+
+
+def score_lower_bound(total: int, num_students: int, num_teams: int, members_per_team: int) -> float:
+    """
+    team_score の下限 (どの割り当てでもこれ以上になる)
+
+    チームの MI 合計は整数なので、人数 s のチームの1人あたりの合計は a / s の形の値しか取れない
+    人数が m と m - 1 のチームが混ざると、全員の合計 total を整数に分けたときの1人あたりの値が揃わないことがある
+    どの生徒がどのチームに入るかは無視し、チーム毎の合計を整数とした緩和問題の最適値を求める
+    """
+    sizes = {}
+    large = num_students - num_teams * (members_per_team - 1)
+    for size, count in [(members_per_team, large), (members_per_team - 1, num_teams - large)]:
+        # 空のチームは team_score の差を広げるだけなので、除いても下限のまま
+        if size > 0 and count > 0:
+            sizes[size] = count
+    if not sizes:
+        return 0.0
+    if len(sizes) == 1:
+        ((size, count),) = sizes.items()
+        return 0.0 if total % count == 0 else round(1 / size, 6)
+
+    # 最適な区間 [lo, hi] の両端はいずれかのチームの a / s で、全チームを floor/ceil(mean × s) にした
+    # 割り当てで差は 2 / (m - 1) 未満になるため、a は mean × s から 4 以内だけを調べれば足りる
+    mean = Fraction(total, num_students)
+    lows = {Fraction(a, s) for s in sizes for a in range(floor(mean * s) - 4, floor(mean * s) + 1)}
+    highs = {Fraction(a, s) for s in sizes for a in range(ceil(mean * s), ceil(mean * s) + 5)}
+    best = None
+    for lo in lows:
+        for hi in highs:
+            if best is not None and hi - lo >= best:
+                continue
+            bounds = [(ceil(lo * s), floor(hi * s), count) for s, count in sizes.items()]
+            if all(a <= b for a, b, _ in bounds) and (
+                sum(a * c for a, _, c in bounds) <= total <= sum(b * c for _, b, c in bounds)
+            ):
+                best = hi - lo
+    return 0.0 if best is None else round(float(best), 6)
+
+
+def solve_candidate(table: StudentTable, constraint: Constraint, options: SolverOptions | None = None):
+    """
+    ワーカープロセスで1つの構成を解く
+    """
+    teams, status, error = matching(table, constraint, options=options)
+    if teams is None:
+        return None, status.value, error, None
+    return teams, status.value, error, team_score(table, teams)
+
+
+async def sweep(
+    table: StudentTable,
+    constraint: Constraint,
+    configs: list[tuple[int, int]],
+    options: SolverOptions | None = None,
+) -> tuple[Candidate | None, list[Candidate]]:
+    """
+    候補の構成を並列に解き、スコアが最も良い構成を返す
+    見つかった解のスコアが、まだ終わっていない候補の下限 (score_lower_bound) 以下になった時点で、
+    その候補は取り消す (下限が小さい候補から先に投入する)
+    options.deterministic の場合は、どの候補が先に終わっても同じ結果になるように全ての候補を解く
+    """
+    options = options or SolverOptions()
+    candidates = [Candidate(num_teams=t, members_per_team=m) for t, m in configs]
+    total = int(table.mi.sum())
+    for candidate in candidates:
+        candidate.bound = score_lower_bound(total, len(table), candidate.num_teams, candidate.members_per_team)
+
+    conflict_clique = largest_conflict_clique(table, constraint)
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    futures = {}
+    for candidate in sorted(candidates, key=lambda c: (c.bound, c.num_teams, c.members_per_team)):
+        candidate_constraint = constraint.model_copy(
+            update={
+                "max_num_teams": candidate.num_teams,
+                "members_per_team": candidate.members_per_team,
+            }
+        )
+        reason = infeasible_reason(table, candidate_constraint, conflict_clique)
+        if reason:
+            candidate.state, candidate.reason = "skipped", reason
+            continue
+        future = executor.submit(solve_candidate, table, candidate_constraint, options)
+        futures[asyncio.wrap_future(future, loop=loop)] = (future, candidate)
+
+    best = None
+    pending = set(futures)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            _, candidate = futures[task]
+            if task.cancelled():
+                continue
+            teams, status, error, score = task.result()
+            if teams is None:
+                candidate.state, candidate.reason = "failed", error
+                continue
+            candidate.state, candidate.reason = "solved", LpStatusType(status).name
+            candidate.score, candidate.teams = score, teams
+            if best is None or candidate.key < best.key:
+                best = candidate
+
+        if best is not None and not options.deterministic:
+            # 下限でも今の最良の構成に勝てない候補を取り消す
+            # (実行中の候補は止められないが、結果は待たずに使わない)
+            for task in list(pending):
+                future, candidate = futures[task]
+                if (candidate.bound, candidate.num_teams, candidate.members_per_team) >= best.key:
+                    future.cancel()
+                    candidate.state = "cancelled"
+                    pending.discard(task)
+
+    return best, candidates
@@ -0,0 +1,45 @@
+import time
+from contextlib import contextmanager
+
+
+class Timings:
+    """
+    処理の段階毎の経過時間 (time.perf_counter_ns)
+    同じ名前の区間を複数回計測した場合は合計する
+    名前は "matching.build.sex" のようにドットで区切る
+    """
+
+    def __init__(self):
+        self.spans: dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+
+    def add(self, name: str, elapsed_ns: int):
+        self.spans[name] = self.spans.get(name, 0) + elapsed_ns
+
+    def as_ms(self) -> dict[str, float]:
+        """
+        計測した順のミリ秒 (小数第3位まで)
+        """
+        return {name: round(ns / 1e6, 3) for name, ns in self.spans.items()}
+
+
+class RequestTimingMiddleware:
+    """
+    リクエストを受け取った時刻を request.state.received_ns に記録する ASGI ミドルウェア
+    ハンドラーまでの時間 (本文の受信・JSON の解析・検証) を測るため
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_ns"] = time.perf_counter_ns()
+        await self.app(scope, receive, send)
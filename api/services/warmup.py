@@ -0,0 +1,134 @@
+import os
+import time
+import asyncio
+import logging
+
+from typing import TYPE_CHECKING
+
+from models.match import Constraint, StudentConstraint
+
+if TYPE_CHECKING:
+    from models.table import StudentTable
+
+logger = logging.getLogger(__name__)
+
+# False の場合はウォームアップせず、起動直後から /ready を返す
+SOLVER_WARMUP = os.getenv("SOLVER_WARMUP", "True") == "True"
+# True の場合はウォームアップでソルバーのプール (services.pool) のワーカーも SOLVER_WORKERS 個起動する
+# 既定では起動せず、最初の /match/sweep でプールを作り、ワーカーは各自の initializer でウォームアップする
+SOLVER_WARMUP_POOL = os.getenv("SOLVER_WARMUP_POOL", "False") == "True"
+
+# 6人を3人ずつの2チームに分ける (前回のチームは3つ、嫌いな生徒の組が1つ)
+WARMUP_CONSTRAINT = Constraint(max_num_teams=2, members_per_team=3)
+
+
+def warmup_table() -> "StudentTable":
+    from models.table import StudentTable
+
+    return StudentTable.from_constraints([
+        StudentConstraint(
+            student_no=i,
+            dislikes=[1] if i == 0 else [],
+            previous=i % 3,
+            # チーム全体のスコアの上限 (MAX_SCORE * 人数 * チーム数) に収まるように、得意な分野は1つだけにする
+            **{f"mi_{c}": 8 if k == i else 1 for k, c in enumerate("abcdefgh")},
+            leader=8 if i < 2 else 1,
+            eyesight=3 if i == 5 else 1,
+            sex=i % 2,
+        )
+        for i in range(6)
+    ])
+
+
+def solve_warmup_instance() -> float:
+    """
+    matching() で小さな問題を1回解き、かかった秒数を返す
+    PuLP の import、CBC の実行ファイルの探索と読み込み、NumPy の初回の呼び出しを済ませておく
+    """
+    from services.match import matching
+
+    start = time.perf_counter()
+    teams, _, error = matching(warmup_table(), WARMUP_CONSTRAINT)
+    if teams is None:
+        raise RuntimeError(f"Warm-up instance was not solved: {error}")
+    return time.perf_counter() - start
+
+
+def warm_worker():
+    """
+    ソルバーのプールのワーカーの initializer (プロセスの起動時に1回)
+    失敗してもプールは壊さず、ログに残すだけにする (実際の問題を解くときに同じエラーになる)
+    """
+    try:
+        logger.info(f"Solver worker {os.getpid()} warmed up in {solve_warmup_instance():.2f}s")
+    except Exception as e:
+        logger.error(f"Solver worker {os.getpid()} failed to warm up: {str(e)}")
+
+
+def worker_pid() -> int:
+    # 先に起動したワーカーが全ての問い合わせを受けないように、少しだけ待ってから返す
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class Readiness:
+    """
+    ウォームアップの状態 (/ready が返す)
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.error: str | None = None
+        self.seconds: float | None = None
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "error": self.error, "warmup_seconds": self.seconds}
+
+
+readiness = Readiness()
+
+
+async def warm_up():
+    """
+    lifespan で起動するバックグラウンドのタスク
+    メインプロセスで1回解き、SOLVER_WARMUP_POOL の場合はソルバーのプールのワーカーを全て起動して
+    initializer を終えるまで待つ。その間も / (liveness) には応答する
+    """
+    if not SOLVER_WARMUP:
+        readiness.ready = True
+        return
+
+    start = time.perf_counter()
+    workers = 0
+    try:
+        # /match はメインプロセスで解くため、イベントループを塞がないようにスレッドで解く
+        solve_seconds = await asyncio.to_thread(solve_warmup_instance)
+        if SOLVER_WARMUP_POOL:
+            workers = await start_pool()
+    except Exception as e:
+        readiness.error = str(e)
+        logger.error(f"Warm-up failed: {str(e)}")
+        return
+    readiness.seconds = time.perf_counter() - start
+    readiness.ready = True
+    logger.info(
+        f"Warm-up finished in {readiness.seconds:.2f}s "
+        f"(solve {solve_seconds:.2f}s, {workers} solver workers)"
+    )
+
+
+async def start_pool() -> int:
+    """
+    ソルバーのプールのワーカーを全て起動し、initializer を終えるまで待って、起動したワーカー数を返す
+    """
+    # ソルバーのプールは、import main ではなくここで読み込む
+    from services.pool import SOLVER_WORKERS, get_executor
+
+    # 空いているワーカーが無い間は submit 毎にワーカーを起動するため、SOLVER_WORKERS 個で全て起動する
+    # ワーカーは initializer を終えてから問い合わせを受けるため、全てのワーカーから返事があれば準備完了
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    pids = set()
+    while len(pids) < SOLVER_WORKERS:
+        pids.update(await asyncio.gather(*[loop.run_in_executor(executor, worker_pid) for _ in range(SOLVER_WORKERS)]))
+    return len(pids)
@@ -0,0 +1,76 @@
+-- +goose Up
+BEGIN;
+
+-- 更新時に updated_at を更新する (API のアンケートのキャッシュは updated_at の最大値で最新か確かめる)
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = clock_timestamp();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+CREATE TRIGGER surveys_set_updated_at
+  BEFORE UPDATE ON surveys
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE TRIGGER students_set_updated_at
+  BEFORE UPDATE ON students
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE TRIGGER student_preferences_set_updated_at
+  BEFORE UPDATE ON student_preferences
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- NG指定の追加・削除 (更新は削除と追加で行う) で、その回答の updated_at を更新する
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION touch_preference_from_dislike() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE student_preferences SET updated_at = clock_timestamp() WHERE id = NEW.preference_id;
+  END IF;
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    UPDATE student_preferences SET updated_at = clock_timestamp() WHERE id = OLD.preference_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+CREATE TRIGGER student_dislikes_touch_preference
+  AFTER INSERT OR UPDATE OR DELETE ON student_dislikes
+  FOR EACH ROW EXECUTE FUNCTION touch_preference_from_dislike();
+
+-- 名簿番号・性別の変更で、その学生の全ての回答の updated_at を更新する
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION touch_preferences_from_student() RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE student_preferences SET updated_at = clock_timestamp() WHERE student_id = NEW.id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+CREATE TRIGGER students_touch_preferences
+  AFTER UPDATE OF student_no, sex ON students
+  FOR EACH ROW
+  WHEN (OLD.student_no IS DISTINCT FROM NEW.student_no OR OLD.sex IS DISTINCT FROM NEW.sex)
+  EXECUTE FUNCTION touch_preferences_from_student();
+
+COMMIT;
+
+-- +goose Down
+BEGIN;
+
+DROP TRIGGER IF EXISTS students_touch_preferences ON students;
+DROP TRIGGER IF EXISTS student_dislikes_touch_preference ON student_dislikes;
+DROP TRIGGER IF EXISTS student_preferences_set_updated_at ON student_preferences;
+DROP TRIGGER IF EXISTS students_set_updated_at ON students;
+DROP TRIGGER IF EXISTS surveys_set_updated_at ON surveys;
+
+DROP FUNCTION IF EXISTS touch_preferences_from_student();
+DROP FUNCTION IF EXISTS touch_preference_from_dislike();
+DROP FUNCTION IF EXISTS set_updated_at();
+
+COMMIT;